@@ -1,5 +1,3 @@
-import threading
-
 from flask import Flask
 from flask_injector import FlaskInjector
 from injector import singleton
@@ -11,7 +9,7 @@ from core.analyser import TweetAnalyser
 app = Flask(__name__)
 
 
-def start(db, ta):
+def configure(db, ta=None):
     # Initialize Flask-Injector. This needs to be run *after* you attached all
     # views, handlers, context processors and template globals.
     app.register_blueprint(rest.bp)
@@ -23,17 +21,34 @@ def start(db, ta):
             to=db,
             scope=singleton,
         )
-        binder.bind(
-            TweetAnalyser,
-            to=ta,
-            scope=singleton,
-        )
+        if ta is not None:
+            binder.bind(
+                TweetAnalyser,
+                to=ta,
+                scope=singleton,
+            )
 
     FlaskInjector(app=app, modules=[module], )
 
-    app.run('0.0.0.0', port=5001)
+    return app
+
+
+def start(db, ta, production=False, threads=16, port=5001):
+    """
+    Serves the web front end. The default is Flask's development server; production mode serves through waitress, a
+    multi-threaded WSGI server, with API reads on per-thread read-only connections.
+
+    :param threads: waitress worker threads, in production mode
+    """
+    configure(db, ta)
+
+    if not production:
+        app.run('0.0.0.0', port=port)
+        return
+
+    from waitress import serve
 
-    thread = threading.Thread(target=start, args=())
-    thread.daemon = True  # Daemonize thread
-    thread.start()
+    # Every open dashboard holds a thread for its event stream, so keep some back for ordinary requests
+    rest.broadcaster.max_clients = max(1, threads - 4)
 
+    serve(app, host='0.0.0.0', port=port, threads=threads)
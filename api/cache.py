@@ -0,0 +1,83 @@
+import functools
+import hashlib
+import time
+
+from flask import Response, request
+
+from api.encoding import encode, negotiate
+from core import domain
+from core.cache import LRUCache
+
+
+class CachedResponse:
+    def __init__(self, generation, body, mimetype):
+        self.generation = generation
+        self.created = time.time()
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """
+    Bounded cache of encoded API responses, keyed by route and query arguments. An entry is served until the database
+    write generation moves on or it is older than ttl seconds, whichever comes first. The ttl also covers results that
+    change without a write, such as the rolling 24h windows expiring old tweets.
+    """
+
+    def __init__(self, maxsize=256, ttl=5.0):
+        self.entries = LRUCache(maxsize)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        entry = self.entries.peek(key)
+        if entry is None or entry.generation != generation or time.time() - entry.created > self.ttl:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry
+
+    def put(self, key, generation, body, mimetype):
+        entry = CachedResponse(generation, body, mimetype)
+        self.entries.put(key, entry)
+        return entry
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self.entries), 'maxsize': self.entries.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+
+responses = ResponseCache()
+
+
+def cached(view):
+    """
+    Decorator for API views returning data to encode. The encoded body is served from the response cache while it is
+    fresh, with an ETag so that clients holding the same body get a 304. Each negotiated encoding is cached separately.
+    Views returning a Response (errors) are not cached.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        mimetype, pretty = negotiate()
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), mimetype)
+        generation = domain.Database.instance.generation
+
+        entry = responses.get(key, generation)
+        if entry is None:
+            data = view(*args, **kwargs)
+            if isinstance(data, Response):
+                return data
+            entry = responses.put(key, generation, encode(data, mimetype, pretty), mimetype)
+
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept'
+        return response.make_conditional(request)
+
+    return wrapper
@@ -0,0 +1,49 @@
+import json
+from enum import Enum
+
+import msgpack
+from flask import request
+
+from core.domain import Serializable
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+
+
+def negotiate():
+    """
+    Picks the encoding for the current request from its Accept header. JSON is compact unless ?pretty=1 is given.
+
+    :return: tuple of (mimetype, pretty)
+    """
+    mimetype = request.accept_mimetypes.best_match((JSON,) + MSGPACK_TYPES, default=JSON)
+    return mimetype, mimetype == JSON and request.args.get('pretty') == '1'
+
+
+def default(obj):
+    if isinstance(obj, Enum):
+        return obj.name
+
+    if isinstance(obj, Serializable):
+        return obj.to_dict()
+
+    raise TypeError('Cannot encode %s' % type(obj).__name__)
+
+
+class Encoder(json.JSONEncoder):
+    def default(self, obj):
+        return default(obj)
+
+
+def encode(data, mimetype=JSON, pretty=False):
+    """
+    :return: data encoded as bytes of the given mimetype
+    """
+    if mimetype in MSGPACK_TYPES:
+        return msgpack.packb(data, use_bin_type=True, default=default)
+
+    if pretty:
+        return json.dumps(data, sort_keys=True, indent=4, cls=Encoder).encode('utf-8')
+
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, cls=Encoder).encode('utf-8')
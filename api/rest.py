@@ -1,27 +1,46 @@
-import json
 import logging
-from enum import Enum
+from datetime import date, datetime, timedelta, timezone
 
 from flask import Blueprint, Response, request
 from injector import inject
 
-from core import domain
+from api.cache import cached, responses
+from api.encoding import encode, negotiate
+from api.stream import Broadcaster
+from core import domain, geohash, metrics
 from core.analyser import TweetAnalyser
-from core.domain import SubjectType, Serializable
+from core.domain import SubjectType
 
 bp = Blueprint('api', __name__)
 
+TYPE_NAMES = {t.value: t.name for t in SubjectType}
+
 
 def js(data):
-    return json.dumps(data, sort_keys=True, indent=4, cls=Encoder)
+    mimetype, pretty = negotiate()
+    return Response(encode(data, mimetype, pretty), mimetype=mimetype)
+
+
+def dashboard(db, subj_type, region=None):
+    subjects = db.subjects
+
+    t10 = subjects.top(10, 'desc', subj_type=subj_type, region=region)
+    b10 = subjects.top(10, subj_type=subj_type, region=region)
+    hot = subjects.hot(10, subj_type=subj_type, sort='desc', region=region)
+    trend = subjects.trend(10, subj_type=subj_type, sort='desc', trend_time=1, region=region)
+
+    return {'top10': t10, 'bottom10': b10, 'hot10': hot, 'trend10': trend}
+
+
+broadcaster = Broadcaster(dashboard)
+metrics.gauge('stream_clients', 'Clients connected to the dashboard event stream', func=broadcaster.client_count)
 
 
 @inject
 @bp.route("/api/all", defaults={'subj_type': SubjectType.ALL})
 @bp.route("/api/all/<subj_type>")
+@cached
 def all_data(db: domain.Database, subj_type):
-    subjects = db.subjects
-
     try:
         if type(subj_type) is str:
             subj_type = SubjectType[subj_type.upper()]
@@ -29,48 +48,187 @@ def all_data(db: domain.Database, subj_type):
         logging.exception(e)
         return Response("{'error':'Bad subject type.'}", status=400, mimetype='application/json')
 
-    t10 = subjects.top(10, 'desc', subj_type=subj_type)
-    b10 = subjects.top(10, subj_type=subj_type)
-    hot = subjects.hot(10, subj_type=subj_type, sort='desc')
-    trend = subjects.trend(10, subj_type=subj_type, sort='desc', trend_time=1)
+    # Only tweets routed to the named region, if one is given
+    return dashboard(db, subj_type, request.args.get('region'))
 
-    return js({'top10': t10, 'bottom10': b10, 'hot10': hot, 'trend10': trend})
+
+@inject
+@bp.route("/api/stream/all", defaults={'subj_type': 'all'})
+@bp.route("/api/stream/all/<subj_type>")
+def stream_all(db: domain.Database, subj_type):
+    """
+    Server-Sent Events version of /api/all. Sends a 'full' event with the whole payload, then 'delta' events holding
+    only the ranks that changed, as {key: {size, rows: {rank: row}}}.
+    """
+    try:
+        subj_type = SubjectType[subj_type.upper()]
+    except KeyError as e:
+        logging.exception(e)
+        return Response("{'error':'Bad subject type.'}", status=400, mimetype='application/json')
+
+    client = broadcaster.subscribe(db, subj_type)
+    if client is None:
+        return Response("{'error':'Too many streaming clients.'}", status=503, mimetype='application/json')
+
+    return Response(broadcaster.events(subj_type, client), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @inject
 @bp.route("/api/summaries")
+@cached
 def summaries(db: domain.Database):
     subjects = db.subjects
 
-    days = request.args.get('days', default=7, type=int)            # Last 'n' days of summaries
+    days = request.args.get('days', default=7, type=int)            # Last 'n' days of summaries, if no 'from' date
     limit = request.args.get('limit', default=10, type=int)         # How many subjects (per day) to retrieve
     sort = request.args.get('sort', default='desc', type=str)       # Direction of sort; asc or desc.
     at_least = request.args.get('at_least', default=1, type=int)    # Minimum number of tweets on a subject
+    page_size = request.args.get('page_size', default=500, type=int)  # Maximum number of summaries in the response
 
-    summaries_raw = subjects.summaries(days=days, limit=limit, sort=sort, at_least=at_least)
+    try:
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else datetime.now(timezone.utc).date()
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args else end - timedelta(days=days - 1)
+        subj_type = SubjectType[request.args.get('type', default='all').upper()]
+        cursor = decode_cursor(request.args.get('cursor'))
+        rows, next_cursor = subjects.summaries(start, end, limit=limit, sort=sort, at_least=at_least,
+                                               subj_type=subj_type, cursor=cursor,
+                                               page_size=min(max(page_size, 1), 5000))
+    except (KeyError, ValueError) as e:
+        logging.exception(e)
+        return Response("{'error':'Bad summaries query.'}", status=400, mimetype='application/json')
 
     response_map = {}
 
-    for row in summaries_raw:
-        if row.day not in response_map:
-            response_map[row.day] = []
+    # Straight from the rows to plain dicts for the encoder, in the same shape as SubjectSummary.to_dict()
+    for subject, day, subj_type, num_tweets, sum_sentiment, avg_sentiment, rank in rows:
+        if day not in response_map:
+            response_map[day] = []
 
-        response_map[row.day].append(row)
+        response_map[day].append({'subject': subject, 'day': day, 'subject_type': TYPE_NAMES[subj_type],
+                                  'num_tweets': num_tweets, 'sum_sentiment': sum_sentiment,
+                                  'avg_sentiment': avg_sentiment})
 
-    return js({"content": response_map, "meta": {"size": len(summaries_raw)}})
+    return {"content": response_map, "meta": {"size": len(rows), "next": encode_cursor(next_cursor)}}
 
 
-class Encoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Enum):
-            return obj.name
+def encode_cursor(cursor):
+    """
+    Summaries are paged by the (day, rank) of the last row sent, which is passed back as '<day>:<rank>'.
+    """
+    return None if cursor is None else '%s:%d' % cursor
 
-        if isinstance(obj, Serializable):
-            return obj.to_dict()
 
-        return json.JSONEncoder.encode(self, obj)
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    day, rank = cursor.rsplit(':', 1)
+    return date.fromisoformat(day).isoformat(), int(rank)
 
 
 @bp.route("/api/loc")
 def location(ta: TweetAnalyser):
-    return js(ta.locations_arr)
+    # The box enclosing every region, or just the named one's
+    name = request.args.get('region')
+    if name is None:
+        return js(ta.locations_arr)
+
+    for region in ta.regions:
+        if region.name == name:
+            return js(region.corners())
+    return Response("{'error':'Unknown region.'}", status=404, mimetype='application/json')
+
+
+@bp.route("/api/regions")
+def regions(ta: TweetAnalyser):
+    return js({region.name: region.corners() for region in ta.regions})
+
+
+@inject
+@bp.route("/api/heatmap")
+@cached
+def heatmap(db: domain.Database):
+    precision = request.args.get('precision', default=domain.TweetRepo.TILE_PRECISION, type=int)  # Geohash length
+    hours = request.args.get('hours', default=24, type=int)         # Last 'n' hours of tweets
+    subject = request.args.get('subject')                           # Only tweets with this subject
+    region = request.args.get('region')                             # Only tweets routed to this region
+
+    try:
+        bbox = decode_bbox(request.args.get('bbox'))                # Only tweets inside south,west,north,east
+        rows, tiles = db.tweets.heatmap(precision, hours, subject=subject, region=region, bbox=bbox)
+    except ValueError as e:
+        logging.exception(e)
+        return Response("{'error':'Bad heatmap query.'}", status=400, mimetype='application/json')
+
+    cells = []
+    for cell, count, sum_sentiment in rows:
+        lat, long = geohash.centre(cell)
+        cells.append([cell, lat, long, count, sum_sentiment / count])
+
+    return {'precision': precision, 'tiles': tiles, 'cells': cells}
+
+
+@inject
+@bp.route("/api/subject/<path:name>/history")
+@cached
+def subject_history(db: domain.Database, name):
+    resolution = request.args.get('resolution', default='day', type=str)  # Period to sum over; day, week or month
+    days = request.args.get('days', default=90, type=int)                 # Last 'n' days of history, if no 'from' date
+
+    try:
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else datetime.now(timezone.utc).date()
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args else end - timedelta(days=days - 1)
+        periods = db.history.history(name, start, end, resolution)
+    except ValueError as e:
+        logging.exception(e)
+        return Response("{'error':'Bad history query.'}", status=400, mimetype='application/json')
+
+    if periods is None:
+        return Response("{'error':'Unknown subject.'}", status=404, mimetype='application/json')
+
+    return {'subject': name, 'resolution': resolution,
+            'history': [[day.isoformat(), count, total, total / count if count else None]
+                        for day, count, total in periods]}
+
+
+def decode_bbox(bbox):
+    if not bbox:
+        return None
+    south, west, north, east = [float(corner) for corner in bbox.split(',')]
+    return south, west, north, east
+
+
+@inject
+@bp.route("/api/caches")
+def caches(db: domain.Database, ta: TweetAnalyser):
+    stats = db.cache_stats()
+    stats['responses'] = responses.stats()
+    stats['annotations'] = ta.memo.stats()
+    return js(stats)
+
+
+@inject
+@bp.route("/api/health")
+def health(db: domain.Database):
+    try:
+        db.reader().execute('SELECT 1;').fetchone()
+    except Exception as e:
+        logging.exception(e)
+        return Response("{'error':'Database unavailable.'}", status=503, mimetype='application/json')
+
+    return js({'status': 'ok'})
+
+
+@inject
+@bp.route("/api/ready")
+def ready(ta: TweetAnalyser):
+    # Not ready until the models are loaded and tweets are being analysed; the dashboard works before then
+    response = js({'ready': ta.ready.is_set(), 'startup': metrics.startup_phases()})
+    if not ta.ready.is_set():
+        response.status_code = 503
+    return response
+
+
+@bp.route("/api/metrics")
+def metrics_text():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,153 @@
+import logging
+import queue
+import threading
+import time
+
+from api.encoding import encode
+from core import metrics
+
+
+class Broadcaster:
+    """
+    Pushes the dashboard payload to every connected Server-Sent Events client. The payload for each subject type is
+    built once per tick, however many clients are watching it, and clients are only sent the ranks that changed.
+    """
+
+    def __init__(self, build, interval=5.0, max_pending=16, max_clients=None):
+        """
+        :param build: function of (db, subj_type) returning the dashboard payload, a dict of ranked row lists
+        :param interval: seconds between ticks
+        :param max_pending: messages queued for a client before it is considered too slow and dropped
+        :param max_clients: most clients streaming at once, or None for no limit
+        """
+        self.build = build
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.clients = {}  # subj_type -> set of client queues
+        self.latest = {}  # subj_type -> last payload sent
+        self.db = None
+        self.thread = None
+
+    def subscribe(self, db, subj_type):
+        """
+        :return: a queue of encoded SSE messages for the new client, starting with the full payload, or None if there
+            are already max_clients clients
+        """
+        client = queue.Queue(self.max_pending)
+
+        with self.lock:
+            if self.max_clients is not None and sum(len(c) for c in self.clients.values()) >= self.max_clients:
+                return None
+
+            self.db = db
+            # Nobody is watching this type, so the last payload built for it may be out of date
+            if not self.clients.get(subj_type):
+                self.latest[subj_type] = self.build(db, subj_type)
+            client.put(message('full', self.latest[subj_type]))
+            self.clients.setdefault(subj_type, set()).add(client)
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=())
+                self.thread.daemon = True
+                self.thread.start()
+
+        return client
+
+    def client_count(self):
+        with self.lock:
+            return sum(len(c) for c in self.clients.values())
+
+    def unsubscribe(self, subj_type, client):
+        with self.lock:
+            self.clients.get(subj_type, set()).discard(client)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                metrics.error('stream', e)
+                logging.exception(e)
+
+    def tick(self):
+        with self.lock:
+            watched = [subj_type for subj_type, clients in self.clients.items() if clients]
+
+        for subj_type in watched:
+            payload = self.build(self.db, subj_type)
+            changes = delta(self.latest.get(subj_type), payload)
+            self.latest[subj_type] = payload
+
+            if changes is None:
+                msg = message('full', payload)
+            elif changes:
+                msg = message('delta', changes)
+            else:
+                continue
+
+            with self.lock:
+                for client in list(self.clients[subj_type]):
+                    try:
+                        client.put_nowait(msg)
+                    except queue.Full:
+                        self.clients[subj_type].discard(client)
+                        close(client)
+
+    def events(self, subj_type, client, keepalive=15.0):
+        """
+        Generator of SSE messages for a streaming response, which unsubscribes the client once it disconnects, and ends
+        the response once the client has been dropped for falling behind.
+        """
+        try:
+            while True:
+                try:
+                    msg = client.get(timeout=keepalive)
+                except queue.Empty:
+                    msg = ': keepalive\n\n'
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            self.unsubscribe(subj_type, client)
+
+
+def close(client):
+    """
+    Discards a dropped client's pending messages, and queues None in their place to end its response.
+    """
+    while True:
+        try:
+            client.get_nowait()
+        except queue.Empty:
+            break
+    client.put_nowait(None)
+
+
+def delta(old, new):
+    """
+    :return: the changed ranks of each list in new, as {key: {'size': length, 'rows': {rank: row}}}, or None if a full
+        payload is cheaper to send
+    """
+    if old is None or old.keys() != new.keys():
+        return None
+
+    changes = {}
+    changed = 0
+    for key, rows in new.items():
+        before = old[key]
+        diff = {i: row for i, row in enumerate(rows) if i >= len(before) or tuple(before[i]) != tuple(row)}
+        if diff or len(before) != len(rows):
+            changes[key] = {'size': len(rows), 'rows': diff}
+            changed += len(diff)
+
+    if changed > sum(len(rows) for rows in new.values()) / 2:
+        return None
+
+    return changes
+
+
+def message(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, encode(data).decode('utf-8'))
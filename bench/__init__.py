@@ -0,0 +1,4 @@
+"""
+Benchmarks for SiteGeist hot paths. Each module is runnable with ``python3 -m bench.<name>`` from the repository root and
+prints machine readable JSON results.
+"""
@@ -0,0 +1,90 @@
+"""
+Measures the encode time and encoded size of the API payloads, for each negotiated encoding.
+
+    python3 -m bench.encoding [--days 30] [--subjects 300] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import timeit
+from datetime import date, timedelta
+
+from api import app, rest
+from api.encoding import JSON, MSGPACK, Encoder, encode
+from core.domain import BatchWriter, Database, SubjectSummary, SubjectType, Tweet, User
+
+
+def populate(db, days, subjects):
+    random.seed(0)
+
+    writer = BatchWriter(db, flush_size=1000)
+    for i in range(5000):
+        tweet = Tweet(_id=i + 1, user=User('user %d' % (i % 200)), tweet='', sentiment=random.uniform(-1, 1),
+                      time=time.time() - random.uniform(0, 24 * 3600))
+        writer.add(tweet, {SubjectType(s % 6): ['subject %d' % s] for s in random.sample(range(subjects), 5)})
+    writer.flush()
+
+    rows = []
+    for d in range(days):
+        day = (date.today() - timedelta(days=d)).isoformat()
+        for s in range(subjects):
+            n = random.randint(2, 500)
+            total = random.uniform(-n, n)
+            rows.append(('subject %d' % s, day, s % 6, n, total, total / n))
+    db.conn.executemany('INSERT INTO subject_summaries (subject, day, type, num_tweets, sum_sentiment, avg_sentiment) '
+                        'VALUES(?, ?, ?, ?, ?, ?);', rows)
+
+
+def legacy(rows):
+    """
+    The payload as it was built before content negotiation: SubjectSummary objects, pretty printed.
+    """
+    response_map = {}
+    for row in rows:
+        summary = SubjectSummary.map_subject_summary(row)
+        response_map.setdefault(summary.day, []).append(summary)
+    return json.dumps({'content': response_map}, sort_keys=True, indent=4, cls=Encoder).encode('utf-8')
+
+
+def measure(name, encoding, func, repeat):
+    seconds = timeit.timeit(func, number=repeat) / repeat
+    return {'endpoint': name, 'encoding': encoding, 'ms': round(seconds * 1000, 3), 'bytes': len(func())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark API payload encodings.')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--subjects', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = Database(path)
+    populate(db, args.days, args.subjects)
+
+    payloads = {}
+    with app.test_request_context('/api/all'):
+        payloads['/api/all'] = rest.all_data.__wrapped__(db, SubjectType.ALL)
+    query = '/api/summaries?days=%d&limit=-1&page_size=5000' % args.days
+    with app.test_request_context(query):
+        payloads['/api/summaries'] = rest.summaries.__wrapped__(db)
+
+    results = []
+    for name, data in payloads.items():
+        results.append(measure(name, 'json-pretty', lambda: encode(data, JSON, pretty=True), args.repeat))
+        results.append(measure(name, 'json', lambda: encode(data, JSON), args.repeat))
+        results.append(measure(name, 'msgpack', lambda: encode(data, MSGPACK), args.repeat))
+
+    rows, _ = db.subjects.summaries(date.today() - timedelta(days=args.days), date.today(), limit=-1, page_size=5000)
+    results.append(measure('/api/summaries', 'legacy', lambda: legacy(rows), args.repeat))
+
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Measures API latency under concurrent clients while tweets are being ingested, with the front end served in production
+mode (waitress, per-thread read connections).
+
+    python3 -m bench.load [--threads 16] [--clients 32] [--seconds 20] [--no-cache]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.request
+
+import api
+from api import cache, rest
+from bench.encoding import populate
+from core.domain import BatchWriter, Database, SubjectType, Tweet, User
+
+ENDPOINTS = ['/api/all', '/api/all/HASHTAG', '/api/summaries?days=30&limit=10']
+
+
+def ingest(db, stop, counter):
+    writer = BatchWriter(db, flush_size=500, flush_interval=1.0)
+    i = 10 ** 6
+    while not stop.is_set():
+        i += 1
+        tweet = Tweet(_id=i, user=User('user %d' % (i % 500)), tweet='', sentiment=random.uniform(-1, 1),
+                      time=time.time())
+        writer.add(tweet, {SubjectType(s % 6): ['subject %d' % s] for s in random.sample(range(300), 5)})
+        counter[0] += 1
+    writer.flush()
+
+
+def client(base, stop, latencies):
+    while not stop.is_set():
+        endpoint = random.choice(ENDPOINTS)
+        start = time.perf_counter()
+        with urllib.request.urlopen(base + endpoint) as response:
+            response.read()
+        latencies.setdefault(endpoint.split('?')[0], []).append(time.perf_counter() - start)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark API latency under load.')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--no-cache', action='store_true', help='Disable the response cache')
+    args = parser.parse_args()
+
+    from waitress import create_server
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db = Database(path)
+    populate(db, 30, 300)
+
+    if args.no_cache:
+        cache.responses.ttl = 0
+
+    app = api.configure(db)
+    rest.broadcaster.max_clients = max(1, args.threads - 4)
+    server = create_server(app, host='127.0.0.1', port=0, threads=args.threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    base = 'http://127.0.0.1:%s' % server.effective_port
+
+    stop = threading.Event()
+    ingested = [0]
+    latencies = {}
+    threads = [threading.Thread(target=ingest, args=(db, stop, ingested))]
+    threads += [threading.Thread(target=client, args=(base, stop, latencies)) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.close()
+
+    for endpoint, values in sorted(latencies.items()):
+        print(json.dumps({'endpoint': endpoint, 'threads': args.threads, 'clients': args.clients,
+                          'cache': not args.no_cache, 'requests': len(values),
+                          'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+                          'p99_ms': round(percentile(values, 0.99) * 1000, 2)}))
+    print(json.dumps({'ingested_per_sec': round(ingested[0] / args.seconds)}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Checks that stream control messages in a batch are skipped without losing the tweets around them: limit notices,
+deletions, and a message with an id but no user or text.
+
+    python3 -m bench.messages
+
+Exits with status 1 if a tweet of the batch isn't stored, or a control message is.
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+from core.analyser import TweetAnalyser
+from core.domain import Database
+
+CONTROL = [
+    {'limit': {'track': 12, 'timestamp_ms': '1539000000000'}},
+    {'delete': {'status': {'id': 90, 'user_id': 3}, 'timestamp_ms': '1539000000000'}},
+    {'id': 91, 'warning': {'code': 'FALLING_BEHIND', 'percent_full': 60}},
+]
+
+
+def main():
+    tweets = [{'id': i, 'text': 'Tweet number %d about #limits' % i, 'user': {'name': 'user%d' % i},
+               'created_at': None} for i in range(1, 7)]
+    # Control messages first, between and after the tweets
+    batch = CONTROL[:1] + tweets[:3] + CONTROL[1:2] + tweets[3:] + CONTROL[2:]
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'messages.db'), warm=False)
+        analyser = TweetAnalyser([], None, None, None, None, batch_size=len(batch), stream=False, db=db)
+        analyser.process_batch(batch)
+        analyser.writer.flush()
+        stored = sorted(row[0] for row in db.conn.execute('SELECT id FROM tweets;'))
+
+    expected = [tweet['id'] for tweet in tweets]
+    print(json.dumps({'bench': 'messages', 'batch': len(batch), 'stored': stored, 'expected': expected}))
+    if stored != expected:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
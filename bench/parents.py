@@ -0,0 +1,127 @@
+"""
+Checks the lookup of reply and quote parents against a stand-in for statuses/lookup, without connecting to twitter:
+unknown parents are looked up in batches of up to 100 ids, a rate limited batch is retried, a parent waited on twice is
+delivered once with replies=2, and a parent that is already stored or pending reuses its subjects. Parents are also
+found for replies and quotes which leave out is_quote_status.
+
+    python3 -m bench.parents [--ids 250] [--duplicates 5]
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from twitter import TwitterError
+
+from core.analyser import TweetAnalyser
+from core.domain import Database, SubjectType, Tweet, User
+from core.parents import RATE_LIMITED, ParentResolver
+
+
+class StandInLookup:
+    """
+    Answers lookups like GetStatuses(ids, map=True), with a plain dict for each status found, after rate limiting the
+    first call.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.limited = False
+
+    def __call__(self, ids):
+        self.calls.append(len(ids))
+        if not self.limited:
+            self.limited = True
+            raise TwitterError([{'code': RATE_LIMITED, 'message': 'Rate limit exceeded'}])
+        return {_id: {'id': _id} for _id in ids}
+
+
+def check_batches(ids, duplicates):
+    lookup = StandInLookup()
+    delivered = {}
+    done = threading.Event()
+
+    def deliver(status, replies):
+        delivered[status['id']] = replies
+        if len(delivered) == ids:
+            done.set()
+
+    # A short rate limit window, so the retry comes quickly
+    resolver = ParentResolver(lookup, deliver, max_wait=0.2, limit=1000, window=0.5)
+    for _id in range(ids):
+        resolver.request(_id)
+    for _id in range(duplicates):
+        resolver.request(_id)
+    done.wait(10)
+
+    expected_calls = [min(ParentResolver.BATCH_SIZE, ids)] + [min(ParentResolver.BATCH_SIZE, ids - i)
+                                                              for i in range(0, ids, ParentResolver.BATCH_SIZE)]
+    return {
+        'calls': lookup.calls,
+        'calls_ok': lookup.calls == expected_calls,
+        'delivered_ok': len(delivered) == ids and all(delivered[_id] == (2 if _id < duplicates else 1)
+                                                      for _id in range(ids)),
+    }
+
+
+def check_known_parents(db):
+    analyser = TweetAnalyser([], None, None, None, None, stream=False, db=db)
+    requested = []
+
+    def lookup(ids):
+        requested.extend(ids)
+        return {}
+
+    analyser.parents = ParentResolver(lookup, lambda status, replies: None, max_wait=0.1)
+
+    def parent_count():
+        c = db.conn.execute("SELECT count(*) FROM tweet_subjects WHERE tweet_id = 1 AND subject = '#parent';")
+        return c.fetchone()[0]
+
+    # Pending, then stored, then quoted. The first reply has no is_quote_status, as some payloads leave it out
+    analyser.writer.add(Tweet(User('author'), 'the #parent tweet', 0.5, _id=1), {SubjectType.HASHTAG: ['#parent']})
+    analyser.process_reply_or_quote({'id': 2, 'in_reply_to_status_id': 1})
+    analyser.writer.flush()
+    pending = parent_count()
+    analyser.process_reply_or_quote({'id': 3, 'in_reply_to_status_id': 1, 'is_quote_status': False})
+    analyser.writer.flush()
+    stored = parent_count()
+    analyser.process_reply_or_quote({'id': 4, 'in_reply_to_status_id': None, 'is_quote_status': True,
+                                     'quoted_status_id': 1})
+    analyser.writer.flush()
+    quoted = parent_count()
+
+    analyser.process_reply_or_quote({'id': 5, 'in_reply_to_status_id': 99})
+    time.sleep(0.5)
+
+    return {
+        'pending_ok': pending == 2,
+        'stored_ok': stored == 3,
+        'quoted_ok': quoted == 4,
+        'unknown_ok': requested == [99],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ids', type=int, default=250)
+    parser.add_argument('--duplicates', type=int, default=5)
+    args = parser.parse_args()
+
+    results = check_batches(args.ids, args.duplicates)
+    with tempfile.TemporaryDirectory() as directory:
+        results.update(check_known_parents(Database(os.path.join(directory, 'parents.db'), warm=False)))
+
+    print(json.dumps(dict({'bench': 'parents'}, **results)))
+    if not all(value for key, value in results.items() if key.endswith('_ok')):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
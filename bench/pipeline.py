@@ -0,0 +1,82 @@
+"""
+Measures the throughput of each stage of tweet ingest over synthetic stream tweets: text extraction, spaCy annotation,
+sentiment, subject extraction, and the batched database writes.
+
+    python3 -m bench.pipeline [--tweets 2000] [--seed 0] [--stages get_text,annotate,sentiment,subjects,writes]
+        [--subjects entity,hashtag,mention,phrase,word,emoji]
+
+The annotate, sentiment and subjects stages load the spaCy model. The writes stage alone does not; without the subjects
+stage it writes the hashtags and mentions found by regular expression. --subjects loads only the spaCy components the
+given subject types need, as main.py --subjects does.
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+
+from bench.synthetic import generate
+from core.domain import BatchWriter, Database, SubjectType, Tweet, User
+
+STAGES = ['get_text', 'annotate', 'sentiment', 'subjects', 'writes']
+
+
+def timed(stage, n, func):
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    print(json.dumps({'bench': 'pipeline', 'stage': stage, 'tweets': n, 'seconds': round(seconds, 4),
+                      'per_sec': round(n / seconds) if seconds else None}))
+    return result
+
+
+def regex_subjects(text):
+    return {SubjectType.HASHTAG: re.findall(r'#[\w_-]+', text), SubjectType.MENTION: re.findall(r'@[\w_-]+', text)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of tweet ingest.')
+    parser.add_argument('--tweets', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--subjects', default='entity,hashtag,mention,phrase,word,emoji')
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    tweets = list(generate(args.tweets, seed=args.seed))
+    n = len(tweets)
+
+    from core.analyser import TweetProcessor
+    texts = timed('get_text', n, lambda: [TweetProcessor.get_text(tweet) for tweet in tweets])
+
+    subjects = None
+    if {'annotate', 'sentiment', 'subjects'} & set(stages):
+        processor = TweetProcessor([SubjectType[name.upper()] for name in args.subjects.split(',')])
+        print(json.dumps({'bench': 'pipeline', 'pipes': processor.nlp.pipe_names}))
+        docs = timed('annotate', n, lambda: list(processor.annotate_batch(texts, args.batch_size)))
+        if 'sentiment' in stages:
+            timed('sentiment', n, lambda: processor.compute_sentiments(docs))
+        if 'subjects' in stages:
+            subjects = timed('subjects', n, lambda: [processor.find_subjects(doc) for doc in docs])
+
+    if 'writes' in stages:
+        if subjects is None:
+            subjects = [regex_subjects(text) for text in texts]
+
+        db = Database(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        writer = BatchWriter(db, flush_size=200, flush_interval=3600)
+
+        def write():
+            for tweet, text, found in zip(tweets, texts, subjects):
+                writer.add(Tweet(_id=tweet['id'], user=User(tweet['user']['name']), tweet=text, sentiment=0.0,
+                                 time=tweet['created_at']), found)
+            writer.flush()
+
+        timed('writes', n, write)
+
+
+if __name__ == '__main__':
+    main()
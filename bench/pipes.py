@@ -0,0 +1,68 @@
+"""
+Checks TweetProcessor.load_pipeline for every combination of subject types: that it loads just the spaCy components
+the types need (the named entity recogniser for entities, the tagger for words and phrases, and the parser for phrases'
+noun chunks), that sentiment still gets sentence boundaries without the parser, and that the subjects found are those
+the full pipeline finds for the same types.
+
+    python3 -m bench.pipes [--tweets 500] [--seed 0]
+
+Exits with status 1 if a combination loads the wrong components or finds different subjects.
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import sys
+
+from bench.synthetic import generate
+from core.analyser import SUBJECT_TYPES, TweetProcessor
+from core.domain import SubjectType
+
+
+def expected_pipes(subject_types):
+    pipes = set()
+    if SubjectType.ENTITY in subject_types:
+        pipes.add('ner')
+    if SubjectType.WORD in subject_types or SubjectType.PHRASE in subject_types:
+        pipes.add('tagger')
+    if SubjectType.PHRASE in subject_types:
+        pipes.add('parser')
+    return pipes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the spaCy pipeline loaded for each combination of subject types.')
+    parser.add_argument('--tweets', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = [TweetProcessor.get_text(tweet) for tweet in generate(args.tweets, seed=args.seed)]
+    full = TweetProcessor()
+    full_docs = list(full.annotate_batch(texts))
+
+    failed = False
+    types = sorted(SUBJECT_TYPES, key=lambda t: t.value)
+    for combination in itertools.chain.from_iterable(itertools.combinations(types, n) for n in range(1, len(types) + 1)):
+        processor = TweetProcessor(combination, scorer=full.scorer)
+        docs = list(processor.annotate_batch(texts))
+        sentiments = processor.compute_sentiments(docs)
+
+        # The full pipeline's annotations, extracting only the same types
+        reference = copy.copy(full)
+        reference.subject_types = frozenset(combination)
+        mismatches = sum(processor.find_subjects(doc) != reference.find_subjects(full_doc)
+                         for doc, full_doc in zip(docs, full_docs))
+
+        pipes = set(processor.nlp.pipe_names) & {'tagger', 'parser', 'ner'}
+        ok = pipes == expected_pipes(combination) and len(sentiments) == len(texts) and not mismatches
+        failed = failed or not ok
+        print(json.dumps({'bench': 'pipes', 'types': [t.name.lower() for t in combination],
+                          'pipes': processor.nlp.pipe_names, 'tweets': len(docs), 'mismatches': mismatches, 'ok': ok}))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
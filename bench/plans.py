@@ -0,0 +1,93 @@
+"""
+Checks that the indexes of schema version 2 are what the time and user name queries use, by their EXPLAIN QUERY PLAN
+before and after migrating: a version 1 database, with a few rows, scans tweets and users, and once Database has
+migrated it the same lookups use idx_tweets_ts on the legacy partition (idx_tweets_<yyyymmdd>_ts on the others) and
+idx_users_name.
+
+    python3 -m bench.plans
+
+Prints each plan, and exits with status 1 if a plan doesn't scan or use the expected index.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+from core.domain import MIGRATIONS, Database, SubjectRepo, since
+
+
+def plan(conn, query, params):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()]
+
+
+def check(conn, schema, checks):
+    """
+    :param checks: list of (name, query, params, words), each word of which must be in the query plan
+    :return: whether every plan has all its words
+    """
+    ok = True
+    for name, query, params, expected in checks:
+        steps = plan(conn, query, params)
+        # Whole words, so an index name isn't matched inside a longer one
+        words = {word for step in steps for word in step.replace('(', ' ').split()}
+        missing = [word for word in expected if word not in words]
+        ok = ok and not missing
+        print(json.dumps({'bench': 'plans', 'schema': schema, 'query': name, 'plan': steps, 'missing': missing}))
+    return ok
+
+
+def version_1(path):
+    """
+    Creates a database as the original schema left it, with a tweet and its user and subject.
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.executescript('\n'.join(MIGRATIONS[0]) + '\nPRAGMA user_version = 1;')
+    conn.execute("INSERT INTO users (id, name) VALUES (1, 'name');")
+    conn.execute("INSERT INTO tweets (id, user_id, tweet, sentiment, time) VALUES (1, 1, 'A tweet', 0.5, "
+                 "datetime('now', '-1 minute'));")
+    conn.execute("INSERT INTO subjects (subject, type) VALUES ('subject', 1);")
+    conn.execute("INSERT INTO tweet_subjects (tweet_id, subject) VALUES (1, 'subject');")
+    return conn
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'plans.db')
+
+        conn = version_1(path)
+        ok = check(conn, 1, [
+            ('tweets_since', "SELECT count(*), total(sentiment) FROM tweets WHERE time >= datetime('now', '-1 hour');",
+             [], ['SCAN', 'tweets']),
+            ('user_id', 'SELECT id FROM users u WHERE u.name = ? LIMIT 1;', ['name'], ['SCAN', 'u']),
+            ('writer_users', 'INSERT INTO users (name) SELECT ? WHERE NOT EXISTS '
+                             '(SELECT 1 FROM users u WHERE u.name = ?);', ['name', 'name'], ['SCAN', 'u']),
+        ])
+        conn.close()
+
+        db = Database(path, warm=False)
+        version = db.conn.execute('PRAGMA user_version;').fetchone()[0]
+        print(json.dumps({'bench': 'plans', 'migrated_to': version, 'latest': len(MIGRATIONS)}))
+        ok = ok and version == len(MIGRATIONS)
+
+        # The migrated rows are in the legacy partition, and today's partition is created for new tweets
+        suffixes = [row[0] for row in db.conn.execute('SELECT suffix FROM partitions;').fetchall()]
+        ts_indexes = ['idx_tweets_ts' if suffix == 'legacy' else 'idx_tweets_%s_ts' % suffix for suffix in suffixes]
+
+        ok = check(db.conn, version, [
+            ('tweets_since', 'SELECT count(*), total(sentiment) FROM tweets WHERE ts >= ?;', [since(hours=1)],
+             ts_indexes),
+            ('trend', SubjectRepo.BASE_QUERY + ' GROUP BY ts.subject ORDER BY total DESC LIMIT ?;',
+             [since(hours=1), 10], ts_indexes),
+            ('user_id', 'SELECT id FROM users u WHERE u.name = ? LIMIT 1;', ['name'], ['idx_users_name']),
+            ('writer_users', 'INSERT INTO users (name) SELECT ? WHERE NOT EXISTS '
+                             '(SELECT 1 FROM users u WHERE u.name = ?);', ['name', 'name'], ['idx_users_name']),
+        ]) and ok
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Measures the latency of the dashboard and summary queries as the amount of stored data grows.
+
+    python3 -m bench.queries [--sizes 10000,100000,1000000] [--repeat 20]
+
+Each size is a count of tweet_subjects rows in the last 24 hours, four per tweet. The subject_summaries table gets 30
+days of rows, in proportion. top, hot and trend are timed both from the in-memory aggregates (as served) and from SQL
+(SubjectRepo.window), since the aggregates can be switched off. The summaries are also written into the subject
+history, which is read a subject at a time. Every tweet is located in one of a few clusters around
+a city, for the heatmap queries: from the tiles, and from the R*Trees by bounding box, by subject, and over everything.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import timeit
+from datetime import date, timedelta
+
+from core.domain import BatchWriter, Database, SubjectType, Tweet, User
+
+SUBJECTS_PER_TWEET = 4
+
+# Centres of the clusters tweets are located in, and a viewport around the first
+CLUSTERS = [(54.047, -2.801), (54.070, -2.870), (54.010, -2.790), (54.130, -2.780)]
+VIEWPORT = (54.040, -2.815, 54.055, -2.790)
+
+
+def populate(db, rows, seed=0):
+    rng = random.Random(seed)
+    vocabulary = max(100, rows // 50)
+    subjects = ['subject%d' % i for i in range(vocabulary)]
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, vocabulary + 1)))
+    now = time.time()
+
+    writer = BatchWriter(db, flush_size=5000, flush_interval=3600)
+    for i in range(rows // SUBJECTS_PER_TWEET):
+        found = {}
+        for subject in rng.choices(subjects, cum_weights=cum_weights, k=SUBJECTS_PER_TWEET):
+            found.setdefault(SubjectType(int(subject[7:]) % 6), []).append(subject)
+        lat, long = rng.choice(CLUSTERS)
+        writer.add(Tweet(_id=i + 1, user=User('user%d' % (i % 5000)), tweet='', sentiment=rng.uniform(-1, 1),
+                         time=now - rng.uniform(0, 23.5 * 3600), lat=rng.gauss(lat, 0.01), long=rng.gauss(long, 0.01)),
+                   found)
+    writer.flush()
+
+    summaries = []
+    for d in range(30):
+        day = (date.today() - timedelta(days=d + 1)).isoformat()
+        for s in range(vocabulary // 10):
+            count = rng.randint(2, 500)
+            total = rng.uniform(-count, count)
+            summaries.append(('subject%d' % s, day, s % 6, count, total, total / count))
+    db.conn.executemany('INSERT INTO subject_summaries (subject, day, type, num_tweets, sum_sentiment, avg_sentiment) '
+                        'VALUES(?, ?, ?, ?, ?, ?);', summaries)
+    db.subjects.backfill_history()
+
+
+def measure(rows, name, func, repeat):
+    times = timeit.repeat(func, number=1, repeat=repeat)
+    return {'bench': 'queries', 'rows': rows, 'query': name, 'p50_ms': round(statistics.median(times) * 1000, 3),
+            'max_ms': round(max(times) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark query latency against data size.')
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for rows in [int(size) for size in args.sizes.split(',')]:
+        db = Database(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        start = time.perf_counter()
+        populate(db, rows)
+        print(json.dumps({'bench': 'queries', 'rows': rows, 'populate_s': round(time.perf_counter() - start, 2)}))
+
+        subjects = db.subjects
+        tweets = db.tweets
+        today = date.today()
+        queries = {
+            'top': lambda: subjects.top(10, 'desc'),
+            'hot': lambda: subjects.hot(10, 'desc'),
+            'trend': lambda: subjects.trend(10, 'desc'),
+            'top_sql': lambda: subjects.window('sum DESC, total DESC', 10),
+            'hot_sql': lambda: subjects.window('total DESC', 10),
+            'trend_sql': lambda: subjects.window('total DESC', 10, hours=1),
+            'hot_sql_hashtag': lambda: subjects.window('total DESC', 10, SubjectType.HASHTAG),
+            'summaries': lambda: subjects.summaries(today - timedelta(days=30), today),
+            'summaries_all': lambda: subjects.summaries(today - timedelta(days=30), today, limit=-1, page_size=5000),
+            'history': lambda: db.history.history('subject5', today - timedelta(days=30), today),
+            'history_week': lambda: db.history.history('subject5', today - timedelta(days=30), today, 'week'),
+            'heatmap': lambda: tweets.heatmap(6),
+            'heatmap_viewport': lambda: tweets.heatmap(8, bbox=VIEWPORT),
+            'heatmap_subject': lambda: tweets.heatmap(7, subject='subject5'),
+            'heatmap_points_all': lambda: tweets.heatmap(7),
+        }
+        for name, func in queries.items():
+            print(json.dumps(measure(rows, name, func, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
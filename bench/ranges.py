@@ -0,0 +1,53 @@
+"""
+Checks the default date ranges of the summaries and subject history endpoints: the last 'days' days, up to and
+including today, so 7 days of summaries and 90 of history unless asked otherwise.
+
+    python3 -m bench.ranges
+
+Exits with status 1 if either endpoint returns a different set of days.
+"""
+
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from api import app, rest
+from core.domain import Database
+
+
+def check(name, days, expected):
+    result = {'bench': 'ranges', 'endpoint': name, 'days': len(days), 'expected': len(expected),
+              'first': min(days, default=None), 'last': max(days, default=None)}
+    print(json.dumps(result))
+    return days == expected
+
+
+def main():
+    today = datetime.now(timezone.utc).date()
+    # One summary a day, for longer than either default, and one in the future which neither should include
+    days = [(today - timedelta(days=d)).isoformat() for d in range(-1, 120)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'ranges.db'), warm=False)
+        db.conn.executemany('INSERT INTO subject_summaries (subject, day, type, num_tweets, sum_sentiment, '
+                            'avg_sentiment) VALUES(?, ?, ?, ?, ?, ?);', [('subject', day, 0, 2, 1, 0.5) for day in days])
+        db.subjects.backfill_history()
+
+        with app.test_request_context('/api/summaries'):
+            summaries = set(rest.summaries.__wrapped__(db)['content'])
+        with app.test_request_context('/api/subject/subject/history'):
+            history = rest.subject_history.__wrapped__(db, 'subject')['history']
+
+        ok = check('/api/summaries', summaries, set(days[1:8]))
+        ok &= check('/api/subject/<name>/history', {day for day, count, _, _ in history if count},
+                    set(days[1:91]))
+        ok &= len(history) == 90
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Checks that VaderScorer gives exactly NLTK's VADER compound score, and compares their speed. The corpus is the text of
+synthetic tweets, plus random sentences built to exercise VADER's rules: lexicon words in mixed case, boosters,
+negations, 'least', 'but', idioms, and punctuation runs around words.
+
+    python3 -m bench.sentiment [--tweets 20000] [--sentences 100000] [--seed 0]
+
+Exits with status 1 if any score differs, printing the first few sentences that do.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from nltk.sentiment.vader import BOOSTER_DICT, NEGATE, PUNC_LIST, SPECIAL_CASE_IDIOMS
+
+from bench.synthetic import generate
+from core.analyser import TweetProcessor
+from core.sentiment import NltkVaderScorer, VaderScorer
+
+RULE_WORDS = ['but', 'BUT', 'least', 'at', 'very', 'never', 'so', 'this', 'kind', 'of', 'not', "isn't", 'the']
+
+
+def sentences(n, lexicon, seed=0):
+    rng = random.Random(seed)
+    vocab = sorted(lexicon)
+    rules = sorted(BOOSTER_DICT) + sorted(NEGATE) + RULE_WORDS + ' '.join(SPECIAL_CASE_IDIOMS).split()
+    decorations = PUNC_LIST + ['', '', '', '', '(', ')', '!!!!', ':)', '...']
+
+    for _ in range(n):
+        words = []
+        for _ in range(rng.randint(1, 14)):
+            word = rng.choice(vocab) if rng.random() < 0.5 else rng.choice(rules)
+            if rng.random() < 0.15:
+                word = word.upper()
+            if rng.random() < 0.2:
+                word = rng.choice(decorations) + word
+            if rng.random() < 0.2:
+                word = word + rng.choice(decorations)
+            words.append(word)
+        yield ' '.join(words) + rng.choice(['', '', '.', '!', '!!', '?', '??', '?!?', '!!!!!!'])
+
+
+def timed(scorer, corpus):
+    start = time.perf_counter()
+    scores = scorer.score_batch(corpus)
+    return scores, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check VaderScorer against NLTK, and compare their speed.')
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--sentences', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    reference, fast = NltkVaderScorer(), VaderScorer()
+    corpus = [TweetProcessor.get_text(tweet) for tweet in generate(args.tweets, seed=args.seed)]
+    corpus += list(sentences(args.sentences, fast.lexicon, args.seed))
+
+    expected, reference_seconds = timed(reference, corpus)
+    actual, fast_seconds = timed(fast, corpus)
+
+    mismatches = [(text, e, a) for text, e, a in zip(corpus, expected, actual) if e != a]
+    print(json.dumps({'bench': 'sentiment', 'sentences': len(corpus), 'mismatches': len(mismatches),
+                      'nltk_per_sec': round(len(corpus) / reference_seconds),
+                      'vader_scorer_per_sec': round(len(corpus) / fast_seconds),
+                      'speedup': round(reference_seconds / fast_seconds, 2)}))
+
+    for text, e, a in mismatches[:10]:
+        print(json.dumps({'text': text, 'nltk': e, 'vader_scorer': a}))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
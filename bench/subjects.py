@@ -0,0 +1,108 @@
+"""
+Checks that TweetProcessor.find_subjects gives exactly the subjects of the per-type extractors it replaced, kept below
+as reference_subjects, and compares their speed. Both run over the same spaCy Docs of synthetic tweets, with every
+subject type enabled.
+
+    python3 -m bench.subjects [--tweets 20000] [--seed 0] [--batch-size 32]
+
+Exits with status 1 if any tweet's subjects differ, printing the first few that do.
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+
+import emoji
+
+from bench.synthetic import generate
+from core.analyser import TweetProcessor
+from core.domain import SubjectType
+
+HASH_RE = re.compile(r'\s([#][\w_-]+)')
+MENTION_RE = re.compile(r'\s([@][\w_-]+)')
+
+
+def reference_subjects(processor, res):
+    """
+    The extraction as it was: one walk of the Doc per subject type, two regular expressions, emoji.emoji_lis, and
+    filtering by list membership.
+    """
+    emojis = [d['emoji'] for d in emoji.emoji_lis(res.text)]
+    hashtags = HASH_RE.findall(res.text)
+    mentions = MENTION_RE.findall(res.text)
+
+    entities = []
+    for e in res.ents:
+        if (len(e.text) > 1) & ('http' not in e.text.lower()) & (e.label_ in processor.include_entity_types):
+            if e.text.startswith('#') or e.text.startswith('@'):
+                continue
+            entities.append(e.text.strip())
+
+    words = []
+    for t in res:
+        tl = t.text.lower()
+        if (t.tag_ in processor.include_word_pos) & (tl not in processor.exclude_tokens) & (len(tl) > 1):
+            if tl.startswith('#') or tl.startswith('@'):
+                continue
+            words.append(tl)
+    words = [w for w in words if w not in emojis + entities]
+
+    phrases = []
+    for ch in res.noun_chunks:
+        cht = ch.text.strip()
+        if (len(cht.split()) > 1) & (ch.root.tag_ in processor.include_phrase_pos) & ('http' not in cht) & \
+                (ch.root.text.lower() not in processor.exclude_tokens):
+            if cht.startswith('#') or cht.startswith('@') or (len(cht.split()) == 1):
+                continue
+            phrases.append(cht.lower())
+    phrases = [p for p in phrases if p not in entities]
+
+    return {
+        SubjectType.ENTITY: entities,
+        SubjectType.WORD: words,
+        SubjectType.EMOJI: emojis,
+        SubjectType.HASHTAG: hashtags,
+        SubjectType.MENTION: mentions,
+        SubjectType.PHRASE: phrases,
+    }
+
+
+def timed(func, docs):
+    start = time.perf_counter()
+    results = [func(doc) for doc in docs]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check find_subjects against the per-type extractors it replaced.')
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    processor = TweetProcessor()
+    texts = [TweetProcessor.get_text(tweet) for tweet in generate(args.tweets, seed=args.seed)]
+    # And a few with an emoji which is also a word character, which can be inside a hashtag or mention
+    texts += [' #tagℹ ℹ @userℹx #ℹ' * (i % 2 + 1) for i in range(len(texts) // 50)]
+    docs = list(processor.annotate_batch(texts, args.batch_size))
+
+    expected, reference_seconds = timed(lambda doc: reference_subjects(processor, doc), docs)
+    actual, seconds = timed(processor.find_subjects, docs)
+
+    mismatches = [(doc.text, e, a) for doc, e, a in zip(docs, expected, actual) if e != a]
+    print(json.dumps({'bench': 'subjects', 'tweets': len(docs), 'mismatches': len(mismatches),
+                      'reference_per_sec': round(len(docs) / reference_seconds),
+                      'find_subjects_per_sec': round(len(docs) / seconds),
+                      'speedup': round(reference_seconds / seconds, 2)}))
+
+    for text, e, a in mismatches[:10]:
+        print(json.dumps({'text': text, 'reference': {t.name: s for t, s in e.items()},
+                          'find_subjects': {t.name: s for t, s in a.items()}}))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Seeded generator of synthetic stream tweets, shaped like the dicts GetStreamFilter yields: long tweets carry their text
+in extended_tweet, retweets embed the original in retweeted_status, and there are replies, quotes, emojis, hashtags,
+mentions and links. Hashtags and words are drawn from Zipf-like distributions, so a few subjects are hot and most are
+rare, as in the real stream.
+
+    from bench.synthetic import generate
+    for tweet in generate(1000, seed=1):
+        ...
+"""
+
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+
+WORDS = ('traffic rain train bus coffee match game city park music festival weather queue station market beach '
+         'council school hospital road bridge museum gallery pub food pizza burger street night morning weekend '
+         'concert team goal win loss fans ticket price shop store office work meeting lunch dinner friends family '
+         'dog cat river tram airport flight delay sunshine storm election vote mayor police fire crowd protest '
+         'cinema film theatre show library bike cycle run marathon gym student university exam holiday').split()
+
+ADJECTIVES = ('great terrible amazing awful lovely busy quiet late early happy sad angry beautiful horrible brilliant '
+              'cold hot wet sunny crowded empty new old best worst').split()
+
+NAMES = ('London Manchester Leeds Sheffield Bristol Arsenal Chelsea Liverpool Sarah James Emma Oliver Amazon '
+         'Google Tesco Starbucks BBC').split()
+
+EMOJIS = ['\U0001F600', '\U0001F602', '\U0001F60D', '\U0001F622', '\U0001F621', '\U0001F44D', '\U0001F525',
+          '❤️', '⚽', '☀️', '\U0001F327️', '\U0001F37A']
+
+TEMPLATES = [
+    '{adj} {word} in {name} today',
+    'why is the {word} always so {adj}',
+    'just had the most {adj} {word} with {name}',
+    '{name} {word} was {adj}, never again',
+    'anyone else stuck at the {word}? {adj}',
+    'so {adj} to see the {word} near {name} this {word2}',
+    'the {word} and the {word2} are both {adj} tonight',
+]
+
+
+def zipf_weights(n, s=1.1):
+    """
+    :return: cumulative weights for picking from n items with probability falling off as 1 / rank ** s
+    """
+    return list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def twitter_time(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%a %b %d %H:%M:%S +0000 %Y')
+
+
+class Generator:
+    """
+    :param seed: the same seed always yields the same tweets
+    :param users: number of distinct authors
+    :param hashtags: number of distinct hashtags
+    :param retweets: share of tweets which are retweets of an earlier tweet
+    :param replies: share of tweets which reply to an earlier tweet
+    :param quotes: share of tweets which quote an earlier tweet
+    """
+
+    def __init__(self, seed=0, users=5000, hashtags=2000, retweets=0.3, replies=0.1, quotes=0.05):
+        self.rng = random.Random(seed)
+        self.users = ['user%d' % i for i in range(users)]
+        self.hashtags = ['#tag%d' % i for i in range(hashtags)]
+        self.retweets = retweets
+        self.replies = replies
+        self.quotes = quotes
+        self.history = []  # recent originals, for retweets, replies and quotes to point at
+        self.weights = {'words': zipf_weights(len(WORDS)), 'hashtags': zipf_weights(hashtags),
+                        'users': zipf_weights(users, 0.8)}
+
+    def zipf(self, items, weights):
+        return self.rng.choices(items, cum_weights=self.weights[weights])[0]
+
+    def text(self):
+        rng = self.rng
+        text = rng.choice(TEMPLATES).format(adj=rng.choice(ADJECTIVES), word=self.zipf(WORDS, 'words'),
+                                           word2=self.zipf(WORDS, 'words'), name=rng.choice(NAMES))
+        text = text[0].upper() + text[1:]
+
+        for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            text += ' ' + self.zipf(self.hashtags, 'hashtags')
+        if rng.random() < 0.3:
+            text = '@' + self.zipf(self.users, 'users') + ' ' + text
+        if rng.random() < 0.25:
+            text += ' ' + rng.choice(EMOJIS) * rng.randint(1, 3)
+        if rng.random() < 0.2:
+            text += ' https://t.co/%08x' % rng.getrandbits(32)
+        if rng.random() < 0.2:
+            # A long tweet, which the stream truncates
+            text += '. ' + ' '.join(rng.choice(ADJECTIVES + WORDS) for _ in range(rng.randint(15, 30)))
+
+        return text
+
+    def original(self, _id, ts):
+        text = self.text()
+        user = self.zipf(self.users, 'users')
+        tweet = {
+            'id': _id,
+            'id_str': str(_id),
+            'created_at': twitter_time(ts),
+            'user': {'id': int(user[4:]), 'name': user, 'screen_name': user},
+            'text': text[:140],
+            'truncated': len(text) > 140,
+            'in_reply_to_status_id': None,
+            'is_quote_status': False,
+        }
+        if len(text) > 140:
+            tweet['extended_tweet'] = {'full_text': text}
+        return tweet
+
+    def tweet(self, _id, ts):
+        rng = self.rng
+        roll = rng.random()
+
+        if self.history and roll < self.retweets:
+            original = rng.choice(self.history)
+            tweet = self.original(_id, ts)
+            tweet['retweeted_status'] = original
+            text = 'RT @%s: %s' % (original['user']['screen_name'], original['text'])
+            tweet['text'] = text[:140]
+            tweet['truncated'] = len(text) > 140
+            tweet.pop('extended_tweet', None)
+            return tweet
+
+        tweet = self.original(_id, ts)
+        if self.history and roll < self.retweets + self.replies:
+            parent = rng.choice(self.history)
+            tweet['in_reply_to_status_id'] = parent['id']
+        elif self.history and roll < self.retweets + self.replies + self.quotes:
+            parent = rng.choice(self.history)
+            tweet['is_quote_status'] = True
+            tweet['quoted_status_id'] = parent['id']
+            tweet['quoted_status'] = parent
+
+        self.history.append(tweet)
+        if len(self.history) > 1000:
+            self.history.pop(self.rng.randrange(len(self.history)))
+        return tweet
+
+
+def generate(n, seed=0, start=None, span=24 * 3600, **kwargs):
+    """
+    :param n: number of tweets
+    :param start: epoch seconds of the first tweet, by default span seconds ago
+    :param span: seconds the tweets are spread over, in order
+    :return: generator of n stream tweet dicts with increasing ids and times
+    """
+    gen = Generator(seed, **kwargs)
+    if start is None:
+        start = time.time() - span
+
+    _id = 10 ** 18
+    for i in range(n):
+        _id += gen.rng.randint(1, 1000)
+        yield gen.tweet(_id, start + span * i / n)
@@ -0,0 +1,101 @@
+"""
+Checks that top, hot and trend give the same answer from the in-memory aggregates as from SQL, over the same tweets.
+Tweets are spread over the last 25 hours, with many close to the start of the hourly and the 24 hour windows, and
+across two regions.
+
+    python3 -m bench.windows [--tweets 20000] [--seed 0]
+
+Exits with status 1 if any subject's count or sentiment sum differs between the two.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from core.aggregates import window_start
+from core.domain import BatchWriter, Database, SubjectType, Tweet, User
+
+REGIONS = ['', 'north', 'south']
+
+
+def populate(db, tweets, seed=0):
+    rng = random.Random(seed)
+    now = time.time()
+    writer = BatchWriter(db, flush_size=5000, flush_interval=3600)
+
+    for i in range(tweets):
+        # A third of the tweets within two minutes of either window's start
+        edge = rng.random()
+        if edge < 1 / 6:
+            ago = 3600 + rng.uniform(-120, 120)
+        elif edge < 1 / 3:
+            ago = 24 * 3600 + rng.uniform(-120, 120)
+        else:
+            ago = rng.uniform(0, 25 * 3600)
+        found = {}
+        for _ in range(3):
+            s = rng.randint(0, 199)
+            found.setdefault(SubjectType(s % 6), []).append('subject%d' % s)
+        writer.add(Tweet(_id=i + 1, user=User('user%d' % (i % 500)), tweet='', sentiment=round(rng.uniform(-1, 1), 2),
+                         time=now - ago, region=rng.choice(REGIONS)), found)
+    writer.flush()
+
+
+def totals(rows):
+    return {subject: (total, round(s, 6)) for subject, _, s, total, _ in rows}
+
+
+def compare(subjects):
+    """
+    :return: the checks in which the two paths differ
+    """
+    differences = []
+    queries = [('top', lambda s, c: (s, c), 'sum DESC, total DESC', 24),
+               ('hot', lambda s, c: c, 'total DESC', 24),
+               ('trend', lambda s, c: c, 'total DESC', 1)]
+
+    for name, key, order, hours in queries:
+        for subj_type in (SubjectType.ALL, SubjectType.HASHTAG):
+            for region in (None, 'north'):
+                # Both read in the same bucket, so they have the same window start
+                while True:
+                    start = window_start(hours)
+                    aggregated = subjects.ranked(key, 10 ** 6, 'desc', subj_type, hours, region)
+                    sql = subjects.window(order, 10 ** 6, subj_type, hours, region)
+                    if window_start(hours) == start:
+                        break
+
+                if totals(aggregated) != totals(sql):
+                    differences.append({'query': name, 'type': subj_type.name, 'region': region,
+                                        'aggregates': len(aggregated), 'sql': len(sql)})
+
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'windows.db'))
+        populate(db, args.tweets, args.seed)
+        # Once fed by the writer, and once rebuilt from the stored tweets
+        differences = compare(db.subjects)
+        db.subjects.rebuild_aggregates()
+        differences += compare(db.subjects)
+
+    print(json.dumps({'bench': 'windows', 'tweets': args.tweets, 'differences': len(differences)}))
+    for difference in differences:
+        print(json.dumps(difference))
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory rolling aggregates of subject sentiment, so the dashboard queries don't have to rescan a day of tweets.
+"""
+
+import heapq
+import threading
+import time
+
+# Width of the time buckets, in seconds
+BUCKET = 60
+
+
+def window_start(hours, now=None, bucket=BUCKET):
+    """
+    :return: epoch seconds at which the window of the last few hours starts: the start of the bucket holding the time
+        that many hours ago. The aggregates and the SQL queries both count from here, so they agree.
+    """
+    head = int(time.time() if now is None else now) // bucket
+    return (head - int(hours * 3600) // bucket) * bucket
+
+
+class RollingAggregates:
+    """
+    Per-subject sentiment sums and tweet counts over a sliding window. Observations are held in a ring of fixed-width
+    time buckets (one minute by default, 24 hours in total), alongside running totals for the whole window. As time
+    passes, the oldest buckets are subtracted from the totals and reused.
+
+    Windows are bucket aligned, starting at window_start: the whole of the bucket holding the time the window reaches
+    back to is counted, so a window can take in up to one bucket more than an exact "last few hours" would. The ring
+    holds that partial bucket too.
+    """
+
+    def __init__(self, window=24 * 3600, bucket=BUCKET):
+        self.bucket = bucket
+        self.size = window // bucket + 1
+        self.slots = [{} for _ in range(self.size)]  # subject -> [sum, count], per bucket
+        self.slot_ids = [None] * self.size  # absolute bucket number held in each slot
+        self.totals = {}  # subject -> [sum, count], over the whole window
+        self.types = {}  # subject -> subject type value
+        self.head = int(time.time()) // bucket
+        self.lock = threading.Lock()
+
+    def _expire(self, slot):
+        for subject, (s, c) in self.slots[slot].items():
+            total = self.totals[subject]
+            total[0] -= s
+            total[1] -= c
+            if total[1] <= 0:
+                del self.totals[subject]
+                del self.types[subject]
+        self.slots[slot] = {}
+
+    def _advance(self, now):
+        head = int(now) // self.bucket
+        if head <= self.head:
+            return
+
+        # Only the slots which are about to be reused need expiring, at most one full lap of the ring
+        for b in range(max(self.head + 1, head - self.size + 1), head + 1):
+            slot = b % self.size
+            self._expire(slot)
+            self.slot_ids[slot] = b
+
+        self.head = head
+
+    def since(self):
+        """
+        :return: epoch seconds at which the live window starts
+        """
+        return (self.head - self.size + 1) * self.bucket
+
+    def add(self, subject, subj_type, sentiment, ts, now=None):
+        """
+        Records one occurrence of a subject in a tweet.
+
+        :param subj_type: subject type value, as stored in the subjects table
+        :param sentiment: sentiment of the tweet
+        :param ts: epoch seconds of the tweet
+        """
+        with self.lock:
+            self._advance(time.time() if now is None else now)
+
+            b = min(int(ts) // self.bucket, self.head)
+            if b <= self.head - self.size:
+                return
+
+            slot = b % self.size
+            if self.slot_ids[slot] != b:
+                self._expire(slot)
+                self.slot_ids[slot] = b
+
+            self.types.setdefault(subject, subj_type)
+
+            cell = self.slots[slot].setdefault(subject, [0.0, 0])
+            cell[0] += sentiment
+            cell[1] += 1
+
+            total = self.totals.setdefault(subject, [0.0, 0])
+            total[0] += sentiment
+            total[1] += 1
+
+    def _window(self, hours):
+        if int(hours * 3600) // self.bucket + 1 >= self.size:
+            return self.totals
+
+        # A shorter window, such as the hourly trend, is summed from its most recent buckets
+        window = {}
+        for b in range(self.head - int(hours * 3600) // self.bucket, self.head + 1):
+            slot = b % self.size
+            if self.slot_ids[slot] != b:
+                continue
+            for subject, (s, c) in self.slots[slot].items():
+                cell = window.setdefault(subject, [0.0, 0])
+                cell[0] += s
+                cell[1] += c
+        return window
+
+    def rank(self, key, n=10, sort='asc', subj_type=None, hours=24, now=None):
+        """
+        :param key: function of (sum, count) to rank subjects by
+        :param subj_type: only rank subjects of this type value, or all subjects if None
+        :return: the n highest (sort='desc') or lowest (sort='asc') ranked rows of (subject, type, sum, total, avg),
+            in the same shape as the SubjectRepo queries
+        """
+        with self.lock:
+            self._advance(time.time() if now is None else now)
+
+            window = self._window(hours)
+            rows = ((subject, self.types[subject], s, c) for subject, (s, c) in window.items()
+                    if subj_type is None or self.types[subject] == subj_type)
+
+            select = heapq.nlargest if sort.lower() == 'desc' else heapq.nsmallest
+            ranked = select(n, rows, key=lambda row: key(row[2], row[3]))
+
+        return [(subject, t, s, c, s / c) for subject, t, s, c in ranked]
@@ -1,93 +1,138 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
 import re
 import threading
 import json
+import time
 import schedule
 import spacy
 import twitter
 import emoji
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from twitter import TwitterError
 
+from core import metrics
+from core.cache import LRUCache
 from core.domain import *
+from core.parents import ParentResolver
+from core.regions import bounds, location, route
+from core.sentiment import VaderScorer
+
+NLP_UTILS = './core/nlp_utils'
+SPACY_MODEL = 'en_core_web_sm'
+
+# The spaCy components each subject type's extractor reads from. Hashtags, mentions and emojis only need the tokenizer.
+SUBJECT_PIPES = {
+    SubjectType.ENTITY: {'ner'},
+    SubjectType.PHRASE: {'tagger', 'parser'},  # noun_chunks, and the tag of each chunk's root
+    SubjectType.WORD: {'tagger'},
+}
+SUBJECT_TYPES = frozenset(t for t in SubjectType if t != SubjectType.ALL)
+
+# Hashtags and mentions must follow whitespace. Emojis are the single characters emoji.emoji_lis finds, none of which
+# are ASCII, so the scan picks out non-ASCII characters and checks them against the set (a character class of every
+# emoji is far slower in re). The few emojis which are also word characters (such as ℹ) can be inside a hashtag or
+# mention, so are looked for there too.
+EMOJIS = frozenset(e for e in emoji.UNICODE_EMOJI if len(e) == 1)
+WORD_EMOJIS = frozenset(e for e in EMOJIS if re.match(r'[\w_-]', e))
+SYMBOL_RE = re.compile(r'\s([#@][\w_-]+)|([^\x00-\x7f])')
+
+RECEIVED = metrics.counter('stream_received_total', 'Tweets received from the filter stream')
+QUEUE_DEPTH = metrics.gauge('ingest_queue_depth', 'Tweets waiting for the consumer thread')
+BATCH_SIZES = metrics.histogram('ingest_batch_size', 'Tweets per consumed batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+STAGES = metrics.histogram('ingest_stage_seconds', 'Time spent in each ingest stage. annotate, sentiment and extraction '
+                                                   'are only recorded when analysing in-process', ['stage'])
+MEMO = metrics.counter('analysis_memo_total', 'Analysis memo lookups', ['result'])
+PROCESSED = metrics.counter('tweets_processed_total', 'Tweets analysed and queued for writing')
+PROCESSED_RATE = metrics.Rate()
+metrics.gauge('tweets_per_second', 'Tweets processed per second, over the last minute', func=PROCESSED_RATE.per_second)
+
+
+class TweetProcessor:
+    """
+    The language processing half of the analyser: annotation, sentiment and subject extraction. It holds no database or
+    twitter connections, so it can be built on its own inside a worker process.
+
+    Only the spaCy components needed by the enabled subject types are loaded. Sentiment needs sentence boundaries, which
+    come from the parser when phrases are enabled and from the rule-based sentencizer otherwise.
+    """
+
+    def __init__(self, subject_types=SUBJECT_TYPES, scorer=None, load=True):
+        """
+        :param subject_types: the SubjectTypes to extract. Subjects of other types are always returned empty.
+        :param scorer: the SentimentScorer for each sentence, VaderScorer by default
+        :param load: load the spaCy model, sentiment lexicon and lists now, rather than in a later call to load
+        """
+        self.subject_types = frozenset(subject_types)
+        self.nlp = None
+        self.scorer = scorer
+        self.url_re = re.compile(r'http\S+')
+        if load:
+            self.load()
 
+    def load(self):
+        with metrics.startup_phase('spacy'):
+            self.nlp = self.load_pipeline(self.subject_types)
+        logging.info('spaCy pipeline: %s, extracting %s', ', '.join(self.nlp.pipe_names),
+                     ', '.join(sorted(t.name.lower() for t in self.subject_types)))
 
-class TweetAnalyser:
-    def __init__(self, lat1, long1, lat2, long2, consumer_key, consumer_secret, access_token_key, access_token_secret):
+        if self.scorer is None:
+            with metrics.startup_phase('sentiment'):
+                self.scorer = VaderScorer()
 
-        self.access_token_secret = access_token_secret
-        self.access_token_key = access_token_key
-        self.consumer_secret = consumer_secret
-        self.consumer_key = consumer_key
-        self.locations = ["%f,%f" % (long1, lat1), "%f,%f" % (long2, lat2)]
-        self.locations_arr = [[lat1, long1], [lat2, long2]]
-        self.nlp = spacy.load("en_core_web_sm")
-        self.sentiment = SentimentIntensityAnalyzer()
-        self.url_re = re.compile(r'http\S+')
-        self.hash_re = re.compile(r'\s([#][\w_-]+)')
-        self.mention_re = re.compile(r'\s([@][\w_-]+)')
-        self.db = Database()
-        self.users = self.db.users
-        self.tweets = self.db.tweets
-        self.subjects = self.db.subjects
-        self._load_lists()
-        schedule.every().day.at("00:00").do(self.job)
+        with metrics.startup_phase('lists'):
+            self._load_lists()
 
-        self.api = twitter.Api(consumer_key=self.consumer_key,
-                               consumer_secret=self.consumer_secret,
-                               access_token_key=self.access_token_key,
-                               access_token_secret=self.access_token_secret,
-                               cache=None,
-                               tweet_mode='extended')
-
-        jobs_thread = threading.Thread(target=self.schedule_daemon, args=())
-        jobs_thread.daemon = True
-        jobs_thread.start()
+    @staticmethod
+    def load_pipeline(subject_types):
+        needed = set().union(*(SUBJECT_PIPES.get(t, set()) for t in subject_types))
+        nlp = spacy.load(SPACY_MODEL, disable=[name for name in ('tagger', 'parser', 'ner') if name not in needed])
+        if 'parser' not in needed:
+            nlp.add_pipe(nlp.create_pipe('sentencizer'), first=True)
+        return nlp
 
-        thread = threading.Thread(target=self.run, args=())
-        thread.daemon = True  # Daemonize thread
-        thread.start()
+    @staticmethod
+    def lists_version():
+        """
+        :return: the modification times and sizes of the nlp_utils lists, which change whenever a list is edited
+        """
+        stats = ((name, os.stat(os.path.join(NLP_UTILS, name))) for name in sorted(os.listdir(NLP_UTILS)))
+        return tuple((name, st.st_mtime_ns, st.st_size) for name, st in stats)
 
     def _load_lists(self):
-        with open('./core/nlp_utils/include_phrase_pos.json', 'r', encoding='utf-8') as f:
-            self.include_phrase_pos = json.loads(f.read())
+        self.lists_loaded = self.lists_version()
+        with open(os.path.join(NLP_UTILS, 'include_phrase_pos.json'), 'r', encoding='utf-8') as f:
+            self.include_phrase_pos = frozenset(json.loads(f.read()))
             f.close()
-        with open('./core/nlp_utils/exclude_tokens.json', 'r', encoding='utf-8') as f:
-            self.exclude_tokens = json.loads(f.read())
+        with open(os.path.join(NLP_UTILS, 'exclude_tokens.json'), 'r', encoding='utf-8') as f:
+            self.exclude_tokens = frozenset(json.loads(f.read()))
             f.close()
-        with open('./core/nlp_utils/include_word_pos.json', 'r', encoding='utf-8') as f:
-            self.include_word_pos = json.loads(f.read())
+        with open(os.path.join(NLP_UTILS, 'include_word_pos.json'), 'r', encoding='utf-8') as f:
+            self.include_word_pos = frozenset(json.loads(f.read()))
             f.close()
-        with open('./core/nlp_utils/include_entity_types.json', 'r', encoding='utf-8') as f:
-            self.include_entity_types = json.loads(f.read())
+        with open(os.path.join(NLP_UTILS, 'include_entity_types.json'), 'r', encoding='utf-8') as f:
+            self.include_entity_types = frozenset(json.loads(f.read()))
             f.close()
 
-    def job(self):
-        self.subjects.archive_last_24h()
-
-    @staticmethod
-    def schedule_daemon(interval=1):
-        while True:
-            schedule.run_pending()
-            time.sleep(interval)
-
     def compute_sentiment(self, res):
         """
-        :param res:
-        :return:
+        :param res: annotated tweet text
+        :return: the sum of the sentiment of its sentences
         """
-        snt = 0  # Neutral
-
-        desc = ''
+        return self.compute_sentiments([res])[0]
 
-        for s in res.sents:
-            sentiment = self.sentiment.polarity_scores(s.text)
-
-            desc += '(%.2f) ' % sentiment['compound']
+    def compute_sentiments(self, docs):
+        """
+        Scores the sentences of several annotated texts with one call into the scorer.
 
-            snt += sentiment['compound']
+        :return: list of the sum of the sentiment of each text's sentences
+        """
+        sentences = [[s.text for s in doc.sents] for doc in docs]
+        scores = iter(self.scorer.score_batch([text for texts in sentences for text in texts]))
 
-        return snt, desc
+        return [sum(next(scores) for _ in texts) for texts in sentences]
 
     # This loads the most comprehensive text portion of the tweet
     # Where "data" is an individual tweet, treated as JSON / dict
@@ -121,28 +166,255 @@ class TweetAnalyser:
                                 text = ''
         return text
 
-    def process_tweet(self, tweet):
+    def analyse(self, tweet, res=None, sentiment=None):
+        """
+        Runs the full language pipeline over a raw tweet, without touching the database.
+
+        :param tweet: raw tweet dict, as received from the stream
+        :param res: the tweet text already annotated by spaCy, if available
+        :param sentiment: the sentiment of res, if already computed
+        :return: plain dict of the tweet id, text, sentiment and subject lists keyed by SubjectType
+        """
+        text = self.get_text(tweet)
+
+        if res is None:
+            res = self.annotate(text)
+
+        if sentiment is None:
+            with STAGES.time(stage='sentiment'):
+                sentiment = self.compute_sentiment(res)
 
-        if self.tweets.exists(tweet['id']):
+        with STAGES.time(stage='extraction'):
+            subjects = self.find_subjects(res)
+
+        return {'id': tweet['id'], 'text': text, 'sentiment': sentiment, 'subjects': subjects}
+
+    def annotate(self, text):
+
+        return self.nlp(text)
+
+    def annotate_batch(self, texts, batch_size=32):
+        """
+        Annotates several texts with a single call into the spaCy pipeline, which is far cheaper than one call per text.
+
+        :param texts: list of tweet texts
+        :param batch_size: number of texts spaCy processes at once
+        :return: generator of spaCy Docs, in the same order as texts
+        """
+        return self.nlp.pipe(texts, batch_size=batch_size)
+
+    @staticmethod
+    def symbols(text):
+        """
+        Finds hashtags, mentions and emojis in one scan of the text.
+
+        :return: tuple of lists of hashtags, mentions and emojis, each in order of appearance
+        """
+        hashtags, mentions, emojis = [], [], []
+
+        for tag, symbol in SYMBOL_RE.findall(text):
+            if symbol:
+                if symbol in EMOJIS:
+                    emojis.append(symbol)
+                continue
+
+            (hashtags if tag[0] == '#' else mentions).append(tag)
+            if not WORD_EMOJIS.isdisjoint(tag):
+                emojis.extend(c for c in tag if c in WORD_EMOJIS)
+
+        return hashtags, mentions, emojis
+
+    def find_subjects(self, res):
+        """
+        :param res: annotated tweet text
+        :return: dict of SubjectType to the list of subjects of that type found in the text
+        """
+        enabled = self.subject_types
+        hashtags, mentions, emojis = self.symbols(res.text)
+
+        entities = []
+        if SubjectType.ENTITY in enabled:
+            for e in res.ents:
+                text = e.text
+                if len(text) > 1 and e.label_ in self.include_entity_types and 'http' not in text.lower() \
+                        and not text.startswith(('#', '@')):
+                    entities.append(text.strip())
+
+        words = []
+        if SubjectType.WORD in enabled:
+            skip = set(emojis).union(entities)
+            for t in res:
+                tl = t.lower_
+                if len(tl) > 1 and t.tag_ in self.include_word_pos and tl not in self.exclude_tokens \
+                        and not tl.startswith(('#', '@')) and tl not in skip:
+                    words.append(tl)
+
+        phrases = []
+        if SubjectType.PHRASE in enabled:
+            skip = set(entities)
+            for ch in res.noun_chunks:
+                cht = ch.text.strip()
+                if len(cht.split()) > 1 and ch.root.tag_ in self.include_phrase_pos and 'http' not in cht \
+                        and ch.root.lower_ not in self.exclude_tokens and not cht.startswith(('#', '@')):
+                    cht = cht.lower()
+                    if cht not in skip:
+                        phrases.append(cht)
+
+        subjects = {
+            SubjectType.ENTITY: entities,
+            SubjectType.WORD: words,
+            SubjectType.EMOJI: emojis,
+            SubjectType.HASHTAG: hashtags,
+            SubjectType.MENTION: mentions,
+            SubjectType.PHRASE: phrases,
+        }
+        return {subj_type: found if subj_type in enabled else [] for subj_type, found in subjects.items()}
+
+
+class TweetAnalyser(TweetProcessor):
+    # Analysis results of recently seen texts, keyed by a hash of the text. Retweets all carry the original text, so a
+    # retweet wave only goes through the pipeline once.
+    MEMO_SIZE = 50000
+    MEMO_TTL = 3600
+
+    # Seconds between checks of the nlp_utils lists for changes
+    LISTS_CHECK_INTERVAL = 60
+
+    def __init__(self, regions, consumer_key, consumer_secret, access_token_key, access_token_secret,
+                 batch_size=32, max_latency=1.0, workers=0, flush_size=200, flush_interval=5.0, retention_days=7,
+                 archive_dir=None, stream=True, subject_types=SUBJECT_TYPES, db=None):
+        """
+        :param regions: the named Regions to stream tweets from, all through one filter stream. Each tweet is stored
+            with the region it is routed to.
+        :param subject_types: the SubjectTypes to extract, which decide the spaCy components loaded
+        :param stream: connect to twitter and start the stream, lookup and scheduled job threads. Without it, tweets are
+            only analysed and written when passed to process_batch, and no network access is made.
+        :param db: the Database to write to, by default a new one at the default path
+
+        With the stream on, the models are loaded by warm_up on the consumer thread, so this returns (and the web front
+        end can start) straight away. ready is set once tweets are being analysed.
+        """
+
+        self.access_token_secret = access_token_secret
+        self.access_token_key = access_token_key
+        self.consumer_secret = consumer_secret
+        self.consumer_key = consumer_key
+        self.regions = list(regions)
+        self.locations = [corner for region in self.regions for corner in region.locations()]
+        self.locations_arr = bounds(self.regions) if self.regions else []
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.queue = queue.Queue()
+
+        self.workers = workers
+        self.pool = None
+        if workers > 0:
+            self.pool = POOL_CONTEXT.Pool(workers, initializer=init_worker, initargs=(subject_types,))
+
+        super().__init__(subject_types, load=False)
+        self.ready = threading.Event()
+        self.memo = LRUCache(self.MEMO_SIZE, ttl=self.MEMO_TTL)
+        self.lists_checked = time.time()
+        self.db = db if db is not None else Database(warm=False)
+        self.users = self.db.users
+        self.tweets = self.db.tweets
+        self.subjects = self.db.subjects
+        self.writer = BatchWriter(self.db, flush_size=flush_size, flush_interval=flush_interval)
+        self.api = None
+        self.parents = None
+
+        if not stream:
+            self.warm_up()
             return
 
-        text = self.get_text(tweet)
+        schedule.every().day.at("00:00").do(self.job)
 
-        res = self.annotate(text)
+        self.api = twitter.Api(consumer_key=self.consumer_key,
+                               consumer_secret=self.consumer_secret,
+                               access_token_key=self.access_token_key,
+                               access_token_secret=self.access_token_secret,
+                               cache=None,
+                               tweet_mode='extended')
+        self.parents = ParentResolver(lambda ids: self.api.GetStatuses(ids, map=True), self.deliver_parent)
 
-        uname = tweet['user']['name']
+        jobs_thread = threading.Thread(target=self.schedule_daemon, args=())
+        jobs_thread.daemon = True
+        jobs_thread.start()
+
+        thread = threading.Thread(target=self.run, args=())
+        thread.daemon = True  # Daemonize thread
+        thread.start()
+
+        consumer_thread = threading.Thread(target=self.consume, args=())
+        consumer_thread.daemon = True
+        consumer_thread.start()
+
+    def warm_up(self):
+        """
+        Loads what analysis needs and the web front end doesn't: the repository caches, the spaCy model, the sentiment
+        lexicon and the nlp_utils lists.
+        """
+        with metrics.startup_phase('warm_up'):
+            if not self.db.caches_warmed:
+                with metrics.startup_phase('caches'):
+                    self.db.warm_caches()
+            self.load()
+        self.ready.set()
+
+    def job(self):
+        self.subjects.archive_last_24h()
+        # Only once yesterday is summarised can old partitions go
+        dropped = self.tweets.expire(self.retention_days, self.archive_dir)
+        if dropped:
+            logging.info('Expired tweet partitions %s', ', '.join(dropped))
+
+    @staticmethod
+    def schedule_daemon(interval=1):
+        while True:
+            schedule.run_pending()
+            time.sleep(interval)
+
+    def seen(self, _id):
+        return self.writer.pending(_id) or self.tweets.exists(_id)
+
+    def process_tweet(self, tweet, res=None):
+
+        if self.seen(tweet['id']):
+            return
+
+        return self.persist(tweet, self.analyse(tweet, res))
+
+    def persist(self, tweet, result):
+        """
+        Queues the result of analysing a tweet with the batch writer. Tweets from the stream are only ever written here,
+        on the consumer thread, whether the analysis ran in this process or in a worker.
+
+        :param tweet: raw tweet dict, as received from the stream
+        :param result: dict returned by TweetProcessor.analyse
+        :return: the queued Tweet, or None if it was already seen
+        """
 
-        user = self.get_user(uname)
+        if self.seen(result['id']):
+            return
+
+        uname = tweet['user']['name']
+        lat, long = location(tweet) or (None, None)
 
-        sentiment, desc = self.compute_sentiment(res)
+        t = Tweet(_id=result['id'], user=User(uname), sentiment=result['sentiment'], tweet=result['text'],
+                  time=tweet['created_at'], region=route(self.regions, tweet), lat=lat, long=long)
 
-        t = self.tweets.create(
-            Tweet(_id=tweet['id'], user=user, sentiment=sentiment, tweet=text, time=tweet['created_at']))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            self.log_subjects(result['subjects'])
+        self.writer.add(t, result['subjects'])
 
-        self.extract_subjects(res, t)
+        # A looked up parent tweet counts its subjects once for each reply or quote that was waiting on it
+        for _ in range(tweet.get('replies', 1) - 1):
+            self.writer.add_subjects(t, result['subjects'])
 
-        reply = tweet['in_reply_to_status_id'] is not None
-        quote = tweet['is_quote_status']
+        reply = tweet.get('in_reply_to_status_id') is not None
+        quote = tweet.get('is_quote_status', False)
 
         if reply or quote:
             self.process_reply_or_quote(tweet)
@@ -150,121 +422,248 @@ class TweetAnalyser:
         return t
 
     def process_reply_or_quote(self, tweet):
-        try:
-            tid = tweet['quoted_status_id'] if tweet['is_quote_status'] else tweet['in_reply_to_status_id']
-
-            if not self.tweets.exists(tid):
-                parent = self.api.GetStatus(status_id=tid)
+        """
+        Counts the subjects of the parent tweet of a reply or quote once more. A parent that is already stored (or
+        pending) reuses its stored subjects; an unknown parent is queued for a bulk lookup, and analysed along with the
+        stream tweets once found.
+        """
+        tid = tweet['quoted_status_id'] if tweet.get('is_quote_status', False) else tweet['in_reply_to_status_id']
 
-                text = self.get_text(parent)
+        if not self.seen(tid):
+            # Without a twitter connection an unknown parent can't be looked up
+            if self.parents is not None:
+                self.parents.request(tid)
+            return tweet
 
-                resp = self.annotate(text)
-                psen, desc = self.compute_sentiment(resp)
-                tp = self.tweets.create(
-                    Tweet(_id=tid, user=self.get_user(parent.user.screen_name), sentiment=psen,
-                          tweet=text,
-                          time=parent.created_at))
-            else:
-                tp = self.tweets.find_one(tid)
-                resp = self.annotate(tp.tweet)
+        tp = self.writer.find(tid)
+        if tp is not None:
+            subjects = self.writer.subjects_of(tid)
+        else:
+            tp = self.tweets.find_one(tid)
+            subjects = self.subjects.find_by_tweet(tid)
 
-            # Extract subjects from reply or quoted tweet
-            self.extract_subjects(resp, tp)
-        except TwitterError as te:
-            print(te.message)
+        self.writer.add_subjects(tp, subjects)
 
         return tweet
 
+    def deliver_parent(self, status, replies):
+        """
+        Queues a looked up parent tweet for analysis, in the same shape as a stream tweet.
+
+        :param status: twitter Status of the parent
+        :param replies: number of replies or quotes which were waiting on it
+        """
+        self.queue.put({'id': status.id, 'full_text': status.full_text or status.text,
+                        'user': {'name': status.user.screen_name}, 'created_at': status.created_at,
+                        'coordinates': status.coordinates, 'place': status.place, 'replies': replies})
+
     def run(self):
+        """
+        Reads the filter stream and buffers each tweet for the consumer thread, so that a slow batch never stalls the
+        stream connection.
+        """
 
         while True:
             try:
                 for tweet in self.api.GetStreamFilter(locations=self.locations):
+                    RECEIVED.inc()
+                    self.queue.put(tweet)
 
-                    try:
-                        entity = self.process_tweet(tweet)
-                    except Exception as e:
-                        print(e)
-                        continue
+            except Exception as e:
+                metrics.error('stream', e)
+                logging.exception(e)
+
+    def next_batch(self):
+        """
+        Blocks until a tweet is buffered, then keeps collecting until either batch_size tweets have been gathered or
+        max_latency seconds have passed since the first one arrived.
+
+        :return: list of raw tweet dicts
+        """
+        batch = [self.queue.get()]
+        deadline = time.time() + self.max_latency
 
-                    if entity is None:
-                        continue
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        QUEUE_DEPTH.set(self.queue.qsize())
+        BATCH_SIZES.observe(len(batch))
+        return batch
 
-                    print('@' + entity.user.name + ': ' + self.get_text(tweet))
-                    print("Sentiment = %.2f" % entity.sentiment)
+    def consume(self):
+        # Tweets from the stream queue up until the models are loaded
+        try:
+            self.warm_up()
+        except Exception as e:
+            metrics.error('warm_up', e)
+            logging.exception(e)
+            return
 
+        while True:
+            try:
+                self.process_batch(self.next_batch())
             except Exception as e:
-                print(e)
+                metrics.error('consume', e)
+                logging.exception(e)
 
-    def get_user(self, uname):
-        if not self.users.exists(uname):
-            user = self.users.create(User(uname, self.db))
-        else:
-            user = self.users.find_by_name(uname)
+    def process_batch(self, batch):
+        self.refresh_lists()
+        # The stream also sends control messages, such as limit notices and deletions, which aren't tweets
+        batch = [tweet for tweet in batch if is_tweet(tweet) and not self.seen(tweet['id'])]
 
-        return user
+        for tweet, result in zip(batch, self.analyse_batch(batch)):
+            if result is None:
+                continue
 
-    def annotate(self, text):
+            try:
+                entity = self.persist(tweet, result)
+            except Exception as e:
+                metrics.error('persist', e)
+                logging.exception(e)
+                continue
 
-        return self.nlp(text)
+            if entity is None:
+                continue
 
-    def extract_entities(self, text):
-        entities = []
-        for e in text.ents:
-            if (len(e.text) > 1) & ('http' not in e.text.lower()) & (e.label_ in self.include_entity_types):
-                if e.text.startswith('#') or e.text.startswith('@'):
-                    continue
-                entities.append(e.text.strip())
-        return entities
-
-    def extract_phrases(self, text):
-        phrases = []
-        for ch in text.noun_chunks:
-            cht = ch.text.strip()
-            if (len(cht.split()) > 1) & \
-                (ch.root.tag_ in self.include_phrase_pos) & \
-                ('http' not in cht) & \
-                (ch.root.text.lower() not in self.exclude_tokens):
-                if cht.startswith('#') or cht.startswith('@') or (len(cht.split()) == 1):
-                    continue
-                phrases.append(cht.lower())
-        return phrases
-
-    def hashtags_and_mentions(self, text):
-        hashtags = self.hash_re.findall(text.text)
-        mentions = self.mention_re.findall(text.text)
-        return hashtags, mentions
-
-    def extract_words(self, text):
-        words = []
-        for t in text:
-            tl = t.text.lower()
-            if (t.tag_ in self.include_word_pos) & (tl not in self.exclude_tokens) & (len(tl) > 1):
-                if tl.startswith('#') or tl.startswith('@'):
-                    continue
-                words.append(tl)
-        return words
-
-    def extract_emojis(self, text):
-        return [d['emoji'] for d in emoji.emoji_lis(text.text)]
-
-    def extract_subjects(self, res, tweet):
-        emojis = self.extract_emojis(res)
-        hashtags, mentions = self.hashtags_and_mentions(res)
-        entities = self.extract_entities(res)
-        words = [w for w in self.extract_words(res) if w not in emojis + entities]
-        phrases = [p for p in self.extract_phrases(res) if p not in entities]
-
-        print('\tEntities: {}'.format(entities))
-        print('\tWords: {}'.format(words))
-        print('\tEmojis: {}'.format(emojis))
-        print('\tPhrases: {}'.format(phrases))
-        print('\tHashtags: {}'.format(hashtags))
-        print('\tMentions: {}\n'.format(mentions))
-
-        [self.subjects.create(entity, tweet, SubjectType.ENTITY) for entity in entities]
-        [self.subjects.create(word, tweet, SubjectType.WORD) for word in words]
-        [self.subjects.create(emoji, tweet, SubjectType.EMOJI) for emoji in emojis]
-        [self.subjects.create(hashtag, tweet, SubjectType.HASHTAG) for hashtag in hashtags]
-        [self.subjects.create(mention, tweet, SubjectType.MENTION) for mention in mentions]
-        [self.subjects.create(phrase, tweet, SubjectType.PHRASE) for phrase in phrases]
+            PROCESSED.inc()
+            PROCESSED_RATE.add()
+            logging.debug('@%s: %s', entity.user.name, entity.tweet)
+            logging.debug('Sentiment = %.2f', entity.sentiment)
+
+    @staticmethod
+    def memo_key(text):
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def analyse_batch(self, batch):
+        """
+        Analyses a batch of tweets. Texts analysed recently are answered from the memo, and a text repeated within the
+        batch is only analysed once.
+
+        :param batch: list of raw tweet dicts
+        :return: list of analysis results (None where analysis failed), in the same order as batch
+        """
+        results = [None] * len(batch)
+        misses = {}  # memo key -> indexes into batch, in order of first appearance
+
+        for i, tweet in enumerate(batch):
+            key = self.memo_key(self.get_text(tweet))
+            memo = self.memo.get(key)
+            if memo is not None:
+                MEMO.inc(result='hit')
+                results[i] = dict(memo, id=tweet['id'])
+            else:
+                MEMO.inc(result='miss')
+                misses.setdefault(key, []).append(i)
+
+        analysed = self.analyse_fresh([batch[indexes[0]] for indexes in misses.values()])
+        for (key, indexes), result in zip(misses.items(), analysed):
+            if result is None:
+                continue
+            self.memo.put(key, {k: v for k, v in result.items() if k != 'id'})
+            for i in indexes:
+                results[i] = dict(result, id=batch[i]['id'])
+
+        return results
+
+    def analyse_fresh(self, batch):
+        """
+        Runs a batch of tweets through the pipeline, either in this process or spread across the worker pool.
+        """
+        if not batch:
+            return []
+
+        with STAGES.time(stage='analyse'):
+            if self.pool is None:
+                return analyse_batch(self, batch, self.batch_size)
+
+            # One contiguous chunk per worker, so each can still make use of nlp.pipe. Pool.map keeps the chunks in
+            # order.
+            size = max(1, -(-len(batch) // self.workers))
+            chunks = [batch[i:i + size] for i in range(0, len(batch), size)]
+
+            return [result for results in self.pool.map(analyse_chunk, chunks) for result in results]
+
+    def refresh_lists(self):
+        """
+        Reloads the nlp_utils lists if they have changed on disk, at most every LISTS_CHECK_INTERVAL seconds. The memo
+        is cleared and the worker processes restarted, so no result from the old lists survives. Runs on the consumer
+        thread, between batches.
+        """
+        if time.time() - self.lists_checked < self.LISTS_CHECK_INTERVAL:
+            return
+        self.lists_checked = time.time()
+
+        if self.lists_version() == self.lists_loaded:
+            return
+
+        logging.info('nlp_utils lists changed, reloading')
+        self._load_lists()
+        self.memo.clear()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = POOL_CONTEXT.Pool(self.workers, initializer=init_worker, initargs=(self.subject_types,))
+
+    @staticmethod
+    def log_subjects(subjects):
+        logging.debug('\tEntities: %s', subjects[SubjectType.ENTITY])
+        logging.debug('\tWords: %s', subjects[SubjectType.WORD])
+        logging.debug('\tEmojis: %s', subjects[SubjectType.EMOJI])
+        logging.debug('\tPhrases: %s', subjects[SubjectType.PHRASE])
+        logging.debug('\tHashtags: %s', subjects[SubjectType.HASHTAG])
+        logging.debug('\tMentions: %s', subjects[SubjectType.MENTION])
+
+
+def is_tweet(message):
+    """
+    :param message: dict received from the filter stream, a lookup or a backfill file
+    :return: whether it is a tweet, with an id, a user and text, rather than a stream control message
+    """
+    return message.get('id') is not None and 'user' in message and ('text' in message or 'full_text' in message)
+
+
+def analyse_batch(processor, batch, batch_size=32):
+    """
+    Analyses a batch of raw tweets with one nlp.pipe call. A tweet that fails to analyse yields None rather than
+    failing the whole batch.
+    """
+    texts = [processor.get_text(tweet) for tweet in batch]
+    results = []
+
+    with STAGES.time(stage='annotate'):
+        docs = list(processor.annotate_batch(texts, batch_size))
+
+    with STAGES.time(stage='sentiment'):
+        sentiments = processor.compute_sentiments(docs)
+
+    for tweet, res, sentiment in zip(batch, docs, sentiments):
+        try:
+            results.append(processor.analyse(tweet, res, sentiment))
+        except Exception as e:
+            metrics.error('analyse', e)
+            logging.exception(e)
+            results.append(None)
+
+    return results
+
+
+# Per-process state for the multi-process mode. Each worker builds its own TweetProcessor once, in init_worker.
+worker_processor = None
+
+# Worker processes are spawned rather than forked. The pool is restarted from the consumer thread while the web server,
+# writer and scheduler threads run, and a forked worker could inherit a lock one of them held, or a copy of the model.
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def init_worker(subject_types=SUBJECT_TYPES):
+    global worker_processor
+    worker_processor = TweetProcessor(subject_types)
+
+
+def analyse_chunk(batch):
+    return analyse_batch(worker_processor, batch, len(batch))
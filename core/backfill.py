@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk ingest of tweets from files, for loading stream captures and rebuilding after an incident. Tweets go through the
+same batch analysis and write path as the live stream, without any network access.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from core.domain import Tweet
+
+
+def read_tweets(path, after=0):
+    """
+    Reads a file of tweets, one JSON object per line, gzipped if the name ends in .gz. Lines may be raw stream tweets or
+    rows of a partition archive written by TweetRepo.archive; stream control messages and bad lines are skipped.
+
+    :param after: number of lines to skip without parsing
+    :return: generator of (line number, raw tweet dict)
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for n, line in enumerate(f, start=1):
+            if n <= after:
+                continue
+
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                tweet = json.loads(line)
+            except ValueError:
+                logging.warning('Skipping malformed line %d of %s', n, path)
+                continue
+
+            if 'id' not in tweet or 'user' not in tweet:
+                continue
+
+            # An archived row, rather than a tweet as received from the stream
+            if isinstance(tweet['user'], str):
+                row = tweet
+                tweet = {'id': row['id'], 'full_text': row['tweet'], 'user': {'name': row['user']},
+                         'created_at': row['ts'], 'region': row.get('region', '')}
+                if row.get('lat') is not None:
+                    tweet['coordinates'] = {'coordinates': [row['long'], row['lat']]}
+
+            yield n, tweet
+
+
+class Backfill:
+    """
+    Feeds tweet files through a TweetAnalyser built with stream=False. Progress is recorded in the database each time
+    the writer flushes, so a run that is interrupted carries on from the last tweet written. Once a file is read, the
+    past days its tweets were sent on are summarised, as the nightly job only summarises yesterday.
+    """
+
+    def __init__(self, analyser, checkpoint_size=5000, report_interval=10.0):
+        """
+        :param checkpoint_size: tweets between flushes (and progress records)
+        :param report_interval: seconds between progress reports
+        """
+        self.analyser = analyser
+        self.db = analyser.db
+        self.checkpoint_size = checkpoint_size
+        self.report_interval = report_interval
+
+        # In WAL mode this only risks the last transactions on power loss, which a resumed backfill writes again
+        self.db.conn.execute('pragma synchronous=normal')
+
+    def run(self, path, restart=False):
+        """
+        :param restart: ignore any recorded progress, and read the file from the start
+        :return: number of tweets read
+        """
+        source = os.path.abspath(path)
+        skip, last_id = (0, None) if restart else self.db.tweets.backfill_position(source)
+        if skip:
+            logging.info('Resuming %s after line %d (tweet %s)', path, skip, last_id)
+
+        start = last_report = time.time()
+        read = since_checkpoint = 0
+        batch = []
+        days = set()
+        line = skip
+
+        for line, tweet in read_tweets(path, after=skip):
+            batch.append(tweet)
+            days.add(datetime.fromtimestamp(Tweet.parse_time(tweet.get('created_at')), timezone.utc).date())
+            if len(batch) < self.analyser.batch_size:
+                continue
+
+            self.analyser.process_batch(batch)
+            read += len(batch)
+            since_checkpoint += len(batch)
+            last_id = batch[-1]['id']
+            batch = []
+
+            if since_checkpoint >= self.checkpoint_size:
+                self.checkpoint(source, line, last_id)
+                since_checkpoint = 0
+
+            if time.time() - last_report >= self.report_interval:
+                last_report = time.time()
+                self.report(path, read, last_report - start)
+
+        if batch:
+            self.analyser.process_batch(batch)
+            read += len(batch)
+            last_id = batch[-1]['id']
+        self.checkpoint(source, line, last_id)
+        self.summarise(days)
+
+        self.report(path, read, time.time() - start)
+        return read
+
+    def summarise(self, days):
+        """
+        Summarises the days before today that tweets were backfilled into, and any others never summarised (such as
+        those of an interrupted run), so that expire doesn't delete their hourly rollup first. Today is left to the
+        nightly job.
+        """
+        today = datetime.now(timezone.utc).date()
+        days = {day for day in days if day < today}.union(self.db.subjects.unsummarised_days(today))
+        for day in sorted(days):
+            self.db.subjects.summarise(day)
+        if days:
+            logging.info('Summarised %d days', len(days))
+
+    def checkpoint(self, source, line, last_id):
+        self.analyser.writer.flush()
+        self.db.tweets.set_backfill_position(source, line, last_id)
+
+    @staticmethod
+    def report(path, read, seconds):
+        logging.info('%s: %d tweets in %.1fs, %.0f tweets/s', path, read, seconds, read / seconds if seconds else 0)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Small in-process caches used to avoid repeated point queries against the database. Each keeps hit and miss counters,
+so that their sizes can be tuned against real traffic.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded mapping which evicts the least recently used key once maxsize is reached. If ttl is given, entries also
+    expire that many seconds after they were put.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if self.ttl is not None and self.expires[key] <= time.monotonic():
+                del self.data[key]
+                del self.expires[key]
+                self.misses += 1
+                return default
+
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """
+        Looks up a key without counting a hit or miss, or refreshing its recency.
+        """
+        return self.data.get(key, default)
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if self.ttl is not None:
+                self.expires[key] = time.monotonic() + self.ttl
+            if len(self.data) > self.maxsize:
+                oldest, _ = self.data.popitem(last=False)
+                self.expires.pop(oldest, None)
+
+    def remove(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self.data), 'maxsize': self.maxsize, 'ttl': self.ttl, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class BloomFilter:
+    """
+    Compact set membership filter. A negative answer is certain, a positive answer may be a false positive (at roughly
+    error_rate once capacity items have been added), so positives must be confirmed elsewhere.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.negatives = 0
+        self.positives = 0
+
+    def _positions(self, key):
+        # Kirsch-Mitzenmacher double hashing: derive all k positions from one digest
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for p in self._positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                self.negatives += 1
+                return False
+        self.positives += 1
+        return True
+
+    def stats(self):
+        total = self.negatives + self.positives
+        return {'size': self.count, 'capacity': self.capacity, 'negatives': self.negatives,
+                'positives': self.positives, 'negative_rate': self.negatives / total if total else 0.0}
@@ -8,54 +8,138 @@ Within this file are the bones of a basic Active Record style database API, whic
 users, tweets and subjects.
 """
 
+import atexit
+import gzip
+import json
+import logging
 import math
 import numbers
 import os
+import pathlib
 import sqlite3
+import threading
 import time
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 from enum import Enum
 
+from core import geohash, metrics
+from core.aggregates import RollingAggregates, window_start
+from core.cache import BloomFilter, LRUCache
+from core.history import SubjectHistory
+
+WRITES = metrics.histogram('db_write_seconds', 'Time to write and commit, by repository operation', ['op'])
+QUERIES = metrics.histogram('db_query_seconds', 'Time to answer each dashboard query', ['query'])
+WRITTEN = metrics.counter('db_rows_written_total', 'Rows written by batch flushes', ['table'])
+PENDING = metrics.gauge('writer_pending_tweets', 'Tweets queued in the batch writer, not yet flushed')
+DROPPED = metrics.counter('writer_dropped_tweets_total', 'Tweets dropped because they could not be written')
+
 
 class Database:
     """
     Wrapper class for the SQLite database. Abstracts connection, creation and bootstrapping of the repository classes.
+
+    conn is the single writer connection, used by ingest. Read-only API queries go through reader(), which gives each
+    thread its own query_only connection so they don't queue behind ingest writes on the writer.
     """
     instance = None
 
-    def __init__(self, path='data/tweets.db'):
+    # Page cache per reader connection (KiB), and the memory map shared by all connections through the OS page cache
+    READ_CACHE_KB = 16384
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, path='data/tweets.db', warm=True):
+        """
+        :param warm: preload the repository caches now. Otherwise call warm_caches before ingesting; until then the
+            API answers from SQL.
+        """
         self.path = path
         self.users = None
         self.tweets = None
         self.subjects = None
         self.conn = None
-
-        exists = os.path.isfile(self.path)
-        self.connect()
-        if not exists:
+        # Serialises writes (and their commits) on the shared connection
+        self.lock = threading.RLock()
+        # Bumped on every committed write, so readers can tell whether cached results are stale
+        self.generation = 0
+        self.readers = threading.local()
+        self.caches_warmed = False
+        # Daily subject totals as memory-mapped arrays, in a directory beside the database
+        self.history = SubjectHistory(os.path.join(os.path.dirname(path), 'history'))
+
+        if not os.path.isfile(self.path):
             self.setup()
+        else:
+            self.connect()
+
+        if warm:
+            self.warm_caches()
 
         Database.instance = self
 
     def __del__(self):
         if self.conn is not None:
-            print('Closing db connection')
+            logging.debug('Closing db connection')
             self.conn.close()
 
     def connect(self):
         self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
         self.conn.execute('pragma journal_mode=wal')
+        self.conn.execute('pragma mmap_size=%d' % self.MMAP_SIZE)
+        self.migrate()
         self.users = UserRepo(self)
         self.tweets = TweetRepo(self)
         self.subjects = SubjectRepo(self)
+        self.tweets.partition()
+
+    def reader(self):
+        """
+        :return: the calling thread's read-only connection, opened on first use
+        """
+        conn = getattr(self.readers, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(pathlib.Path(self.path).absolute().as_uri() + '?mode=ro', uri=True)
+            conn.execute('pragma query_only=1')
+            conn.execute('pragma cache_size=-%d' % self.READ_CACHE_KB)
+            conn.execute('pragma mmap_size=%d' % self.MMAP_SIZE)
+            self.readers.conn = conn
+        return conn
 
     def setup(self):
-        print('Creating database')
+        logging.info('Creating database')
         self.connect()
 
-        for ct in [User.sql, Tweet.sql, Subject.sql, SubjectSummary.sql]:
-            print('Executing: %s' % ct)
-            self.conn.executescript(ct)
+    def migrate(self):
+        """
+        Brings the schema up to date. The schema version is kept in SQLite's user_version pragma, and each pending
+        entry of MIGRATIONS is applied in its own transaction, so existing databases pick up schema changes too. An
+        entry which depends on what is already in the database is a function of the connection, returning the statements.
+        """
+        version = self.conn.execute('PRAGMA user_version;').fetchone()[0]
+
+        for v, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            logging.info('Migrating database to version %d', v)
+            with self.lock:
+                try:
+                    if callable(statements):
+                        statements = statements(self.conn)
+                    self.conn.executescript('BEGIN;\n%s\nPRAGMA user_version = %d;\nCOMMIT;' % ('\n'.join(statements), v))
+                except Exception:
+                    if self.conn.in_transaction:
+                        self.conn.execute('ROLLBACK;')
+                    raise
+
+    def warm_caches(self):
+        """
+        Preloads the repository identity caches, so the first tweets after a restart don't all miss.
+        """
+        self.users.warm()
+        self.tweets.warm()
+        self.subjects.warm()
+        self.caches_warmed = True
+
+    def cache_stats(self):
+        return {'users': self.users.ids.stats(), 'tweets': self.tweets.seen.stats(),
+                'subjects': self.subjects.known.stats()}
 
     def recreate(self):
         self.__del__()
@@ -75,15 +159,40 @@ def commit_after(func):
     """
 
     def decorator_func(*args, **kwargs):
-        # Invoke the wrapped function first
-        retval = func(*args, **kwargs)
-        # Now do something here with retval and/or action
-        Database.instance.commit()
+        with Database.instance.lock, WRITES.time(op=func.__qualname__):
+            # Invoke the wrapped function first
+            retval = func(*args, **kwargs)
+            # Now do something here with retval and/or action
+            Database.instance.commit()
+            Database.instance.generation += 1
         return retval
 
     return decorator_func
 
 
+def since(hours=24):
+    """
+    :return: epoch seconds of the given number of hours ago, for comparison against tweets.ts
+    """
+    return int(time.time() - hours * 3600)
+
+
+def hour_of(ts):
+    """
+    :return: epoch seconds of the start of the hour containing ts, as used by subject_hourly
+    """
+    return int(ts) - int(ts) % 3600
+
+
+def direction(sort):
+    """
+    Validates a sort direction before it is formatted into a query.
+    """
+    if sort.lower() not in ('asc', 'desc'):
+        raise ValueError('Sort must be asc or desc. (%s)' % sort)
+    return sort.upper()
+
+
 class Serializable:
     def to_dict(self):
         return self.__dict__
@@ -193,7 +302,7 @@ class SubjectSummary(Serializable):
 
     @staticmethod
     def map_subject_summary(row, user=None):
-        return SubjectSummary(row[0], SubjectType(row[2]), row[4], row[3], row[5], row[1])
+        return SubjectSummary(row[0], SubjectType(row[2]), row[3], row[4], row[5], row[1])
 
     def to_dict(self):
         data = super(SubjectSummary, self).to_dict()
@@ -203,47 +312,374 @@ class SubjectSummary(Serializable):
 
 class Tweet(Entity):
     """
-    Active record representing a tweet.
+    Active record representing a tweet. The time is kept both as a readable UTC string and as integer epoch seconds
+    (ts), which is what all time range queries filter on. region is the name of the geofence the tweet was routed to,
+    or '' if it fell in none of them. lat and long locate the tweet, at its exact coordinates or the centre of its
+    place, and are None if it has neither.
     """
 
     sql = '''CREATE TABLE IF NOT EXISTS tweets (id INTEGER PRIMARY KEY, user_id INTEGER, tweet VARCHAR, sentiment REAL, 
     time DATETIME, FOREIGN KEY (user_id) REFERENCES users(id)); '''
 
-    def __init__(self, user: User, tweet, sentiment=None, _id=None, time=None):
+    def __init__(self, user: User, tweet, sentiment=None, _id=None, time=None, region='', lat=None, long=None):
         super().__init__(_id)
-        if time is None:
-            time = Tweet.time_to_str()
-        elif isinstance(time, numbers.Number):
-            if math.isnan(time):
-                time = Tweet.time_to_str()
-            else:
-                time = Tweet.time_to_str(time)
-        else:
-            time = datetime.strptime(time, '%a %b %d %H:%M:%S %z %Y')
 
         self.user = user
         self.tweet = tweet
         self.sentiment = sentiment
-        self.time = time
+        self.region = region
+        self.lat = lat
+        self.long = long
+        self.ts = int(Tweet.parse_time(time))
+        self.time = Tweet.time_to_str(self.ts)
 
     @staticmethod
-    def time_to_str(ts=time.time()):
-        return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+    def parse_time(value):
+        """
+        :param value: twitter created_at string, stored time string, epoch seconds, or None for now
+        :return: epoch seconds
+        """
+        if value is None or (isinstance(value, numbers.Number) and math.isnan(value)):
+            return time.time()
+        if isinstance(value, numbers.Number):
+            return value
+
+        try:
+            return datetime.strptime(value, '%a %b %d %H:%M:%S %z %Y').timestamp()
+        except ValueError:
+            # Stored times are UTC, with or without an explicit offset
+            dt = datetime.fromisoformat(value)
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+
+    @staticmethod
+    def time_to_str(ts=None):
+        if ts is None:
+            ts = time.time()
+        return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
     @staticmethod
     def map_tweet(row, user=None):
-        return Tweet(_id=row[0], user=user, tweet=row[2], sentiment=row[3], time=row[4])
+        return Tweet(_id=row[0], user=user, tweet=row[2], sentiment=row[3], time=row[5] if row[5] is not None else row[4],
+                     region=row[6], lat=row[7], long=row[8])
+
+
+# Schema migrations, applied in order by Database.migrate. Never edit a released entry; append a new one instead.
+MIGRATIONS = [
+    # 1: original schema
+    [User.sql, Tweet.sql, Subject.sql, SubjectSummary.sql],
+    # 2: integer epoch time on tweets, and covering indexes for the 24h, trend and hot queries
+    [
+        'ALTER TABLE tweets ADD COLUMN ts INTEGER;',
+        "UPDATE tweets SET ts = CAST(strftime('%s', time) AS INTEGER);",
+        'CREATE INDEX IF NOT EXISTS idx_tweets_ts ON tweets (ts, id, sentiment);',
+        'CREATE INDEX IF NOT EXISTS idx_tweet_subjects_tweet ON tweet_subjects (tweet_id, subject);',
+        'CREATE INDEX IF NOT EXISTS idx_tweet_subjects_subject ON tweet_subjects (subject, tweet_id);',
+        'CREATE INDEX IF NOT EXISTS idx_subjects_type ON subjects (subject, type);',
+        'CREATE INDEX IF NOT EXISTS idx_users_name ON users (name, id);',
+    ],
+    # 3: hourly subject rollup, maintained at ingest. Populate it for existing tweets with main.py --backfill-rollup
+    [
+        '''CREATE TABLE IF NOT EXISTS subject_hourly (subject TEXT NOT NULL, hour INTEGER NOT NULL, type INTEGER NOT NULL,
+        count INTEGER NOT NULL, sum_sentiment REAL NOT NULL, PRIMARY KEY (subject, hour));''',
+        'CREATE INDEX IF NOT EXISTS idx_subject_hourly_hour ON subject_hourly (hour, type, subject, count, sum_sentiment);',
+    ],
+    # 4: daily partitions. tweets and tweet_subjects become views over one pair of tables per ingest day, which
+    # TweetRepo.partition creates as needed. Existing rows stay in a single 'legacy' partition.
+    [
+        'CREATE TABLE IF NOT EXISTS partitions (suffix TEXT PRIMARY KEY, day DATE NOT NULL);',
+        'ALTER TABLE tweets RENAME TO tweets_legacy;',
+        'ALTER TABLE tweet_subjects RENAME TO tweet_subjects_legacy;',
+        "INSERT INTO partitions (suffix, day) SELECT 'legacy', coalesce(date(max(ts), 'unixepoch'), date('now')) "
+        "FROM tweets_legacy;",
+        'CREATE VIEW tweets AS SELECT id, user_id, tweet, sentiment, time, ts FROM tweets_legacy;',
+        'CREATE VIEW tweet_subjects AS SELECT tweet_id, subject FROM tweet_subjects_legacy;',
+        'CREATE VIEW recent_subjects AS SELECT ts.subject, t.sentiment, t.ts FROM tweets_legacy t '
+        'CROSS JOIN tweet_subjects_legacy ts ON ts.tweet_id = t.id;',
+    ],
+    # 5: progress of bulk backfills, so an interrupted one can resume
+    [
+        'CREATE TABLE IF NOT EXISTS backfills (source TEXT PRIMARY KEY, line INTEGER NOT NULL, last_id INTEGER);',
+    ],
+    # 6: the region of each tweet, and the hourly rollup kept per region. Existing tweets and rollup rows get no region.
+    # The views are rebuilt with the region column by the first TweetRepo.partition call after migrating.
+    lambda conn: [
+        statement for (suffix,) in conn.execute('SELECT suffix FROM partitions;').fetchall() for statement in (
+            "ALTER TABLE tweets_%s ADD COLUMN region TEXT NOT NULL DEFAULT '';" % suffix,
+            'CREATE INDEX IF NOT EXISTS idx_tweets_%s_region ON tweets_%s (region, ts, id, sentiment);' % (suffix, suffix),
+        )
+    ] + [
+        '''CREATE TABLE subject_hourly_regions (subject TEXT NOT NULL, hour INTEGER NOT NULL,
+        region TEXT NOT NULL DEFAULT '', type INTEGER NOT NULL, count INTEGER NOT NULL, sum_sentiment REAL NOT NULL,
+        PRIMARY KEY (subject, hour, region));''',
+        "INSERT INTO subject_hourly_regions (subject, hour, region, type, count, sum_sentiment) "
+        "SELECT subject, hour, '', type, count, sum_sentiment FROM subject_hourly;",
+        'DROP TABLE subject_hourly;',
+        'ALTER TABLE subject_hourly_regions RENAME TO subject_hourly;',
+        'CREATE INDEX idx_subject_hourly_hour ON subject_hourly (hour, type, subject, count, sum_sentiment);',
+        'CREATE INDEX idx_subject_hourly_region ON subject_hourly (region, hour, type, subject, count, sum_sentiment);',
+    ],
+    # 7: tweet locations, an R*Tree of them per partition, and hourly heatmap tiles. Existing tweets have no location.
+    lambda conn: [
+        statement for (suffix,) in conn.execute('SELECT suffix FROM partitions;').fetchall() for statement in (
+            'ALTER TABLE tweets_%s ADD COLUMN lat REAL;' % suffix,
+            'ALTER TABLE tweets_%s ADD COLUMN long REAL;' % suffix,
+            'CREATE VIRTUAL TABLE IF NOT EXISTS tweet_points_%s USING rtree(id, min_lat, max_lat, min_long, max_long, '
+            '+ts INTEGER, +sentiment REAL, +region TEXT, +geohash TEXT);' % suffix,
+        )
+    ] + [
+        '''CREATE TABLE IF NOT EXISTS geo_hourly (cell TEXT NOT NULL, hour INTEGER NOT NULL,
+        region TEXT NOT NULL DEFAULT '', count INTEGER NOT NULL, sum_sentiment REAL NOT NULL,
+        PRIMARY KEY (cell, hour, region));''',
+        'CREATE INDEX IF NOT EXISTS idx_geo_hourly_hour ON geo_hourly (hour, cell, count, sum_sentiment);',
+        'CREATE INDEX IF NOT EXISTS idx_geo_hourly_region ON geo_hourly (region, hour, cell, count, sum_sentiment);',
+    ],
+    # 8: day ranges of subject_summaries, for paging through the daily rankings
+    [
+        'CREATE INDEX IF NOT EXISTS idx_subject_summaries_day ON subject_summaries (day, num_tweets);',
+    ],
+    # 9: the days archive_day has summarised, whose hourly rollup expire may delete. Days already in subject_summaries
+    # count as summarised; others are summarised by the next backfill.
+    [
+        'CREATE TABLE IF NOT EXISTS summarised_days (day DATE PRIMARY KEY);',
+        'INSERT OR IGNORE INTO summarised_days (day) SELECT DISTINCT day FROM subject_summaries;',
+    ],
+]
 
 
 class TweetRepo:
     """
-    Repository class for tweet-related database operations
+    Repository class for tweet-related database operations.
+
+    Tweets and their subjects are stored in daily partitions: a tweets_<yyyymmdd> and tweet_subjects_<yyyymmdd> table
+    per UTC day of ingest, listed in the partitions table. The tweets and tweet_subjects views union every partition,
+    for reads. The recent_subjects view joins the tweets and subjects of only today's and yesterday's partitions, which
+    hold every tweet of the last 24 hours, so the live queries don't slow down as history accumulates. Writes go to the
+    tables of partition() directly, and old days are dropped whole by expire().
+
+    Located tweets are also indexed in an R*Tree per partition, tweet_points_<yyyymmdd>, which carries the time,
+    sentiment, region and geohash of each so that heatmap queries never read the tweets themselves. geo_hourly sums them
+    into cells of TILE_PRECISION per hour and region, for coarse heatmaps over any number of tweets.
     """
 
+    SEEN_CAPACITY = 2000000
+
+    # Most partitions kept apart. SQLite allows 500 terms in a compound SELECT, so the views can't union many more, and
+    # older days are merged into the legacy partition.
+    MAX_PARTITIONS = 366
+
+    # Geohash length of the precomputed heatmap tiles, cells of about 1.2km by 0.6km
+    TILE_PRECISION = 6
+
+    POINT_INSERT = 'INSERT OR IGNORE INTO tweet_points_%s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?);'
+
+    # Adds located tweets to their tile
+    TILE_UPSERT = '''INSERT INTO geo_hourly (cell, hour, region, count, sum_sentiment) VALUES(?, ?, ?, ?, ?)
+        ON CONFLICT (cell, hour, region) DO UPDATE SET count = count + excluded.count,
+        sum_sentiment = sum_sentiment + excluded.sum_sentiment;'''
+
+    PARTITION_SQL = '''CREATE TABLE IF NOT EXISTS tweets_{0} (id INTEGER PRIMARY KEY, user_id INTEGER, tweet VARCHAR,
+        sentiment REAL, time DATETIME, ts INTEGER, region TEXT NOT NULL DEFAULT '', lat REAL, long REAL);
+        CREATE INDEX IF NOT EXISTS idx_tweets_{0}_ts ON tweets_{0} (ts, id, sentiment);
+        CREATE INDEX IF NOT EXISTS idx_tweets_{0}_region ON tweets_{0} (region, ts, id, sentiment);
+        CREATE TABLE IF NOT EXISTS tweet_subjects_{0} (tweet_id INTEGER, subject TEXT);
+        CREATE INDEX IF NOT EXISTS idx_tweet_subjects_{0}_tweet ON tweet_subjects_{0} (tweet_id, subject);
+        CREATE INDEX IF NOT EXISTS idx_tweet_subjects_{0}_subject ON tweet_subjects_{0} (subject, tweet_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS tweet_points_{0} USING rtree(id, min_lat, max_lat, min_long, max_long,
+            +ts INTEGER, +sentiment REAL, +region TEXT, +geohash TEXT);
+        INSERT OR IGNORE INTO partitions (suffix, day) VALUES ('{0}', '{1}');'''
+
     def __init__(self, db):
         self.db = db
+        # Tweet ids already stored. Only a positive answer from the filter needs confirming against the database.
+        self.seen = BloomFilter(self.SEEN_CAPACITY)
+        # (day, suffix) of the partition currently written to
+        self.current = (None, None)
+
+    def partition(self):
+        """
+        :return: the table suffix of today's (UTC) partition, which is created on the first write of the day
+        """
+        today = datetime.now(timezone.utc).date()
+        if self.current[0] == today:
+            return self.current[1]
+
+        suffix = today.strftime('%Y%m%d')
+        with self.db.lock:
+            merged, added, script = self.merge_sql(suffix)
+            added.append((suffix, today.isoformat()))
+            script = [self.PARTITION_SQL.format(suffix, today.isoformat())] + script + [
+                self.views_sql(today, added=added, dropped=merged)]
+
+            try:
+                self.db.conn.executescript('BEGIN;\n%s\nCOMMIT;' % '\n'.join(script))
+            except Exception:
+                if self.db.conn.in_transaction:
+                    self.db.conn.execute('ROLLBACK;')
+                raise
+            self.current = (today, suffix)
+
+        if merged:
+            logging.info('Merged %d partitions into legacy', len(merged))
+        return suffix
+
+    def merge_sql(self, today):
+        """
+        Keeps the number of partitions at MAX_PARTITIONS, with today's, by merging the oldest days into the legacy
+        partition. It takes the day of the newest merged into it, so expire drops it once all of them are out of the
+        retention period.
+
+        :param today: suffix of today's partition
+        :return: suffixes of the partitions merged, oldest first, [('legacy', day)] if the legacy partition is created
+            for them (otherwise []), and the script merging them
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT suffix, day FROM partitions ORDER BY day;')
+        rows = [(suffix, day) for suffix, day in c.fetchall() if suffix != today]
+        legacy = [row for row in rows if row[0] == 'legacy']
+        oldest = [row for row in rows if row[0] != 'legacy']
+
+        # Counting today's partition, and the legacy one unless it already exists
+        excess = len(rows) + 1 + (0 if legacy else 1) - self.MAX_PARTITIONS
+        if excess <= 0:
+            return [], [], []
+        merged = oldest[:excess]
+        day = max(day for _, day in legacy + merged)
+
+        script = []
+        if not legacy:
+            script.append(self.PARTITION_SQL.format('legacy', day))
+        for suffix, _ in merged:
+            script += [
+                'INSERT OR IGNORE INTO tweets_legacy (id, user_id, tweet, sentiment, time, ts, region, lat, long) '
+                'SELECT id, user_id, tweet, sentiment, time, ts, region, lat, long FROM tweets_%s;' % suffix,
+                'INSERT INTO tweet_subjects_legacy (tweet_id, subject) SELECT tweet_id, subject FROM tweet_subjects_%s;'
+                % suffix,
+                'INSERT OR IGNORE INTO tweet_points_legacy SELECT * FROM tweet_points_%s;' % suffix,
+                'DROP TABLE tweets_%s;' % suffix, 'DROP TABLE tweet_subjects_%s;' % suffix,
+                'DROP TABLE tweet_points_%s;' % suffix,
+                "DELETE FROM partitions WHERE suffix = '%s';" % suffix,
+            ]
+        script.append("UPDATE partitions SET day = '%s' WHERE suffix = 'legacy';" % day)
+
+        return [suffix for suffix, _ in merged], [] if legacy else [('legacy', day)], script
+
+    def views_sql(self, today, added=(), dropped=()):
+        """
+        :param added: (suffix, day) of partitions about to be created
+        :param dropped: suffixes of partitions about to be dropped, which are left out
+        :return: script recreating the views over the partitions
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT suffix, day FROM partitions ORDER BY day;')
+        new = {suffix for suffix, _ in added}
+        rows = [(suffix, day) for suffix, day in c.fetchall() if suffix not in dropped and suffix not in new]
+        rows += list(added)
+        recent = [(suffix, day) for suffix, day in rows if day >= (today - timedelta(days=1)).isoformat()]
+
+        def union(table, columns, partitions):
+            return ' UNION ALL '.join('SELECT %s FROM %s_%s' % (columns, table, suffix) for suffix, _ in partitions)
+
+        # A join against a UNION ALL view is materialised rather than searched by index, so recent_subjects unions the
+        # join of each pair of recent partitions instead. Subjects can be added to a tweet of an earlier day.
+        recent_subjects = ' UNION ALL '.join(
+            'SELECT ts.subject, t.sentiment, t.ts, t.region FROM tweets_%s t '
+            'CROSS JOIN tweet_subjects_%s ts ON ts.tweet_id = t.id'
+            % (t, ts) for t, _ in recent for ts, _ in recent)
+
+        return '\n'.join([
+            'DROP VIEW IF EXISTS tweets;',
+            'DROP VIEW IF EXISTS tweet_subjects;',
+            'DROP VIEW IF EXISTS recent_subjects;',
+            'CREATE VIEW tweets AS %s;' % union('tweets', 'id, user_id, tweet, sentiment, time, ts, region, lat, long', rows),
+            'CREATE VIEW tweet_subjects AS %s;' % union('tweet_subjects', 'tweet_id, subject', rows),
+            'CREATE VIEW recent_subjects AS %s;' % recent_subjects,
+        ])
+
+    def expire(self, retention_days, archive_dir=None):
+        """
+        Drops the partitions of tweets ingested more than retention_days days ago, along with the hourly rollup of
+        those days. Run it after archive_last_24h, so the days are summarised first; the rollup of a day that hasn't been
+        summarised is kept.
+
+        :param retention_days: days of raw tweets to keep, at least 1; 0 keeps everything
+        :param archive_dir: if given, each partition is first written to <archive_dir>/tweets-<yyyymmdd>.jsonl.gz
+        :return: suffixes of the dropped partitions
+        """
+        if retention_days <= 0:
+            return []
+
+        today = datetime.now(timezone.utc).date()
+        cutoff = today - timedelta(days=retention_days)
+
+        c = self.db.conn.cursor()
+        c.execute('SELECT suffix FROM partitions WHERE day < ? ORDER BY day;', [cutoff.isoformat()])
+        dropped = [row[0] for row in c.fetchall()]
+        if not dropped:
+            return []
+
+        if archive_dir is not None:
+            for suffix in dropped:
+                self.archive(suffix, archive_dir)
+
+        cutoff_ts = int(datetime(cutoff.year, cutoff.month, cutoff.day, tzinfo=timezone.utc).timestamp())
+        with self.db.lock:
+            script = [self.views_sql(today, dropped=dropped)]
+            for suffix in dropped:
+                script += ['DROP TABLE tweets_%s;' % suffix, 'DROP TABLE tweet_subjects_%s;' % suffix,
+                           'DROP TABLE tweet_points_%s;' % suffix,
+                           "DELETE FROM partitions WHERE suffix = '%s';" % suffix]
+            script.append("DELETE FROM subject_hourly WHERE hour < %d "
+                          "AND date(hour, 'unixepoch') IN (SELECT day FROM summarised_days);" % cutoff_ts)
+            script.append('DELETE FROM geo_hourly WHERE hour < %d;' % cutoff_ts)
+
+            try:
+                with WRITES.time(op='TweetRepo.expire'):
+                    self.db.conn.executescript('BEGIN;\n%s\nCOMMIT;' % '\n'.join(script))
+            except Exception:
+                if self.db.conn.in_transaction:
+                    self.db.conn.execute('ROLLBACK;')
+                raise
+            self.db.generation += 1
+
+        return dropped
+
+    def archive(self, suffix, archive_dir):
+        """
+        Writes one partition as gzipped JSON lines, one tweet per line with its user name and subjects.
+
+        :return: path of the archive
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT ts.tweet_id, ts.subject, s.type FROM tweet_subjects_%s ts '
+                  'LEFT JOIN subjects s ON s.subject = ts.subject;' % suffix)
+        subjects = {}
+        for tweet_id, subject, subj_type in c.fetchall():
+            subjects.setdefault(tweet_id, []).append([subject, subj_type])
+
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, 'tweets-%s.jsonl.gz' % suffix)
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            c.execute('SELECT t.id, u.name, t.tweet, t.sentiment, t.time, t.ts, t.region, t.lat, t.long '
+                      'FROM tweets_%s t LEFT JOIN users u ON u.id = t.user_id ORDER BY t.id;' % suffix)
+            for _id, name, tweet, sentiment, tweet_time, ts, region, lat, long in c:
+                f.write(json.dumps({'id': _id, 'user': name, 'tweet': tweet, 'sentiment': sentiment,
+                                    'time': tweet_time, 'ts': ts, 'region': region, 'lat': lat, 'long': long,
+                                    'subjects': subjects.get(_id, [])}) + '\n')
+        os.replace(path + '.tmp', path)
+
+        return path
+
+    def warm(self):
+        c = self.db.conn.cursor()
+        for row in c.execute('SELECT id FROM tweets;'):
+            self.seen.add(row[0])
 
     def exists(self, _id):
+        if _id not in self.seen:
+            return False
+
         c = self.db.conn.cursor()
         c.execute('SELECT count(*) FROM tweets t WHERE t.id = ?;', [_id])
 
@@ -252,16 +688,147 @@ class TweetRepo:
     @commit_after
     def create(self, tweet: Tweet):
         c = self.db.conn.cursor()
-        c.execute('INSERT INTO tweets VALUES(?, ?, ?, ?, ?);',
-                  [tweet.id, tweet.user.id, tweet.tweet, tweet.sentiment, tweet.time])
+        c.execute('INSERT INTO tweets_%s (id, user_id, tweet, sentiment, time, ts, region, lat, long) '
+                  'VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?);' % self.partition(),
+                  [tweet.id, tweet.user.id, tweet.tweet, tweet.sentiment, tweet.time, tweet.ts, tweet.region, tweet.lat,
+                   tweet.long])
         tweet.id = c.lastrowid
+        self.seen.add(tweet.id)
+
+        point = self.point_row(tweet)
+        if point is not None:
+            c.execute(self.POINT_INSERT % self.partition(), point)
+            c.execute(self.TILE_UPSERT, [point[8][:self.TILE_PRECISION], hour_of(tweet.ts), tweet.region, 1,
+                                         tweet.sentiment or 0.0])
 
         return tweet
 
-    def delete_older_than_24h(self):
+    @staticmethod
+    def point_row(tweet: Tweet):
+        """
+        :return: the row of a located tweet in its partition's R*Tree, or None if it has no location
+        """
+        if tweet.lat is None or tweet.long is None:
+            return None
+        return (tweet.id, tweet.lat, tweet.lat, tweet.long, tweet.long, tweet.ts, tweet.sentiment or 0.0, tweet.region,
+                geohash.encode(tweet.lat, tweet.long))
+
+    @metrics.timed(QUERIES, query='heatmap')
+    def heatmap(self, precision=TILE_PRECISION, hours=24, subject=None, region=None, bbox=None):
+        """
+        Tweet volume and sentiment over the last few hours, binned into geohash cells.
+
+        Without a subject and at up to TILE_PRECISION this is summed from the hourly tiles, so it costs the same however
+        many tweets there are; a bounding box then keeps the cells whose centre is inside it. Otherwise it is counted
+        from the R*Trees of the partitions in the window, searched by the bounding box, or driven from the subject's
+        tweets. Those windows are exact, the tile windows hour aligned. The R*Trees hold coordinates to single precision,
+        so a bounding box can take in tweets up to about a metre outside it.
+
+        :param precision: geohash length of the cells, from 1 to geohash.MAX_PRECISION
+        :param subject: only count tweets with this subject
+        :param region: only count tweets routed to this region, or tweets from everywhere if None
+        :param bbox: (south, west, north, east) to count tweets inside, or None for everywhere
+        :return: rows of (cell, count, sum_sentiment), and whether they were read from the tiles
+        """
+        if not 1 <= precision <= geohash.MAX_PRECISION:
+            raise ValueError('Precision ranges from 1 to %d. (%s)' % (geohash.MAX_PRECISION, precision))
+
+        c = self.db.reader().cursor()
+
+        if subject is None and precision <= self.TILE_PRECISION:
+            query = 'SELECT substr(cell, 1, ?) AS c, sum(count), sum(sum_sentiment) FROM geo_hourly WHERE hour >= ?'
+            params = [precision, hour_of(since(hours=hours))]
+            if region is not None:
+                query = query + ' AND region = ?'
+                params.append(region)
+            c.execute(query + ' GROUP BY c;', params)
+            rows = c.fetchall()
+
+            if bbox is not None:
+                south, west, north, east = bbox
+                centres = ((row, geohash.centre(row[0])) for row in rows)
+                rows = [row for row, (lat, long) in centres if south <= lat <= north and west <= long <= east]
+            return rows, True
+
+        start = since(hours=hours)
+        # Tweets are stored in the partition of the day they were ingested, which is never before the day they were sent
+        c.execute('SELECT suffix FROM partitions WHERE day >= ?;',
+                  [datetime.fromtimestamp(start, timezone.utc).date().isoformat()])
+        suffixes = [row[0] for row in c.fetchall()]
+
+        where = 'p.ts >= ?'
+        params = [start]
+        if bbox is not None:
+            south, west, north, east = bbox
+            where = where + ' AND p.max_lat >= ? AND p.min_lat <= ? AND p.max_long >= ? AND p.min_long <= ?'
+            params += [south, north, west, east]
+        if region is not None:
+            where = where + ' AND p.region = ?'
+            params.append(region)
+
+        if not suffixes:
+            return [], False
+
+        if subject is None:
+            query = ' UNION ALL '.join('SELECT p.geohash, p.sentiment FROM tweet_points_%s p WHERE %s' % (suffix, where)
+                                       for suffix in suffixes)
+            params = params * len(suffixes)
+        else:
+            # Subjects can be added to a tweet of an earlier day, so the subject's tweet ids are gathered from every
+            # partition in the window once, as a materialised CTE, and each R*Tree is then searched for them by id
+            query = ' UNION ALL '.join('SELECT p.geohash, p.sentiment FROM subject_tweets st CROSS JOIN tweet_points_%s p '
+                                       'ON p.id = st.tweet_id WHERE %s' % (suffix, where) for suffix in suffixes)
+            ids = ' UNION ALL '.join('SELECT tweet_id FROM tweet_subjects_%s WHERE subject = ?' % suffix
+                                     for suffix in suffixes)
+            query = 'WITH subject_tweets AS (%s) %s' % (ids, query)
+            params = [subject] * len(suffixes) + params * len(suffixes)
+
+        c.execute('SELECT substr(geohash, 1, ?) AS c, count(*), total(sentiment) FROM (%s) GROUP BY c;' % query,
+                  [precision] + params)
+        return c.fetchall(), False
+
+    def backfill_tiles(self):
+        """
+        Rebuilds the heatmap tiles from every stored tweet location, in one transaction. Tiles from before the oldest
+        stored tweet are kept, as their tweets may have been expired.
+
+        :return: number of tile rows written
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT suffix FROM partitions;')
+        points = ' UNION ALL '.join('SELECT geohash, ts, region, sentiment FROM tweet_points_%s' % suffix
+                                    for (suffix,) in c.fetchall())
+
+        with self.db.lock, WRITES.time(op='TweetRepo.backfill_tiles'):
+            c.execute('BEGIN;')
+            try:
+                c.execute('DELETE FROM geo_hourly WHERE hour >= (SELECT min(ts) - min(ts) % 3600 FROM tweets);')
+                c.execute('''INSERT INTO geo_hourly (cell, hour, region, count, sum_sentiment)
+                    SELECT substr(geohash, 1, ?) AS cell, ts - ts % 3600 AS hour, region, count(*), total(sentiment)
+                    FROM ({0}) GROUP BY cell, hour, region;'''.format(points), [self.TILE_PRECISION])
+                rows = c.rowcount
+                c.execute('COMMIT;')
+            except Exception:
+                c.execute('ROLLBACK;')
+                raise
+            self.db.generation += 1
+
+        return rows
+
+    def backfill_position(self, source):
+        """
+        :return: (line, last_id) of the last tweet written from a backfill source, or (0, None) if it hasn't been started
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT line, last_id FROM backfills WHERE source = ?;', [source])
+        return c.fetchone() or (0, None)
+
+    @commit_after
+    def set_backfill_position(self, source, line, last_id):
         c = self.db.conn.cursor()
-        rows = c.execute("DELETE FROM tweets WHERE time <= date('now','-1 day')")
-        return rows[0]
+        c.execute('INSERT INTO backfills (source, line, last_id) VALUES(?, ?, ?) '
+                  'ON CONFLICT (source) DO UPDATE SET line = excluded.line, last_id = excluded.last_id;',
+                  [source, line, last_id])
 
     def find_one(self, _id):
         c = self.db.conn.cursor()
@@ -279,8 +846,18 @@ class UserRepo:
     Repository class for user-related database operations
     """
 
+    CACHE_SIZE = 100000
+
     def __init__(self, db):
         self.db = db
+        # user name -> id
+        self.ids = LRUCache(self.CACHE_SIZE)
+
+    def warm(self):
+        c = self.db.conn.cursor()
+        c.execute('SELECT name, id FROM users ORDER BY id DESC LIMIT ?;', [self.ids.maxsize])
+        for name, _id in reversed(c.fetchall()):
+            self.ids.put(name, _id)
 
     def find_all(self):
         c = self.db.conn.cursor()
@@ -289,22 +866,35 @@ class UserRepo:
         return [User.map_user(row) for row in c.fetchall()]
 
     def exists(self, name):
+        return self.find_id(name) is not None
+
+    def find_id(self, name):
+        _id = self.ids.get(name)
+        if _id is not None:
+            return _id
+
         c = self.db.conn.cursor()
-        c.execute('SELECT count(*) FROM users u WHERE u.name = ?;', [name])
+        c.execute('SELECT id FROM users u WHERE u.name = ? LIMIT 1;', [name])
+        row = c.fetchone()
+        if row is None:
+            return None
 
-        return c.fetchone()[0] > 0
+        self.ids.put(name, row[0])
+        return row[0]
 
     def find_by_name(self, name):
-        c = self.db.conn.cursor()
-        c.execute('SELECT * FROM users u WHERE u.name = ? LIMIT 1;', [name])
+        _id = self.find_id(name)
+        if _id is None:
+            return None
 
-        return User.map_user(c.fetchone())
+        return User(name, _id=_id)
 
     @commit_after
     def create(self, user: User):
         c = self.db.conn.cursor()
         c.execute('INSERT INTO users VALUES(NULL, ?);', [user.name])
         user.id = c.lastrowid
+        self.ids.put(user.name, user.id)
         return user
 
 
@@ -313,120 +903,530 @@ class SubjectRepo:
     Repository class for subject-related database operations
     """
 
-    BASE_QUERY = '''SELECT s.subject, s.type, sum(t.sentiment) as sum, count(*) as total, avg(t.sentiment) as avg
-        FROM tweet_subjects ts 
-        LEFT JOIN tweets t ON ts.tweet_id = t.id 
-        LEFT JOIN subjects s on ts.subject = s.subject
-        WHERE t.time >= date('now','-1 day')'''
+    # CROSS JOIN (here and inside recent_subjects) pins the join order, so the query is driven from the tweets.ts indexes
+    # and only visits tweets inside the window, rather than scanning every tweet_subject to avoid the GROUP BY sort.
+    BASE_QUERY = '''SELECT s.subject, s.type, sum(ts.sentiment) as sum, count(*) as total, avg(ts.sentiment) as avg
+        FROM recent_subjects ts
+        CROSS JOIN subjects s on ts.subject = s.subject
+        WHERE ts.ts >= ?'''
+
+    CACHE_SIZE = 200000
+
+    # The same aggregation over the hourly rollup, used for windows of a day or more
+    ROLLUP_QUERY = '''SELECT h.subject, h.type, sum(h.sum_sentiment) as sum, sum(h.count) as total,
+        sum(h.sum_sentiment) / sum(h.count) as avg
+        FROM subject_hourly h
+        WHERE h.hour >= ?'''
+
+    # Adds one tweet subject to its hour and region in the rollup
+    ROLLUP_UPSERT = '''INSERT INTO subject_hourly (subject, hour, region, type, count, sum_sentiment)
+        VALUES(?, ?, ?, ?, ?, ?)
+        ON CONFLICT (subject, hour, region) DO UPDATE SET count = count + excluded.count,
+        sum_sentiment = sum_sentiment + excluded.sum_sentiment;'''
+
+    # Answer top/hot/trend from in-memory rolling aggregates rather than SQL
+    USE_AGGREGATES = True
 
     def __init__(self, db):
         self.db = db
+        # subject -> type value, for subjects already stored
+        self.known = LRUCache(self.CACHE_SIZE)
+        # Set by warm, once built. Until then top, hot and trend are answered by SQL.
+        self.aggregates = None
+        # region -> RollingAggregates of only that region's tweets, built alongside aggregates
+        self.regional = {}
+
+    def warm(self):
+        c = self.db.conn.cursor()
+        c.execute('SELECT subject, type FROM subjects LIMIT ?;', [self.known.maxsize])
+        for subject, subj_type in c.fetchall():
+            self.known.put(subject, subj_type)
+
+        if self.USE_AGGREGATES:
+            self.rebuild_aggregates()
+
+    def rebuild_aggregates(self):
+        aggregates = RollingAggregates()
+        regional = {}
+        c = self.db.conn.cursor()
+        c.execute('''SELECT ts.subject, s.type, ts.sentiment, ts.ts, ts.region FROM recent_subjects ts
+            CROSS JOIN subjects s on ts.subject = s.subject
+            WHERE ts.ts >= ?;''', [aggregates.since()])
+        for subject, subj_type, sentiment, ts, region in c:
+            aggregates.add(subject, subj_type, sentiment, ts)
+            if region:
+                if region not in regional:
+                    regional[region] = RollingAggregates()
+                regional[region].add(subject, subj_type, sentiment, ts)
+        self.regional = regional
+        self.aggregates = aggregates
+
+    def observe(self, subject: str, subj_type, tweet: Tweet):
+        """
+        Feeds a newly written tweet subject into the rolling aggregates, and those of its region.
+
+        :param subj_type: subject type value, as stored in the subjects table
+        """
+        if self.aggregates is None:
+            return
+
+        self.aggregates.add(subject, subj_type, tweet.sentiment, tweet.ts)
+        if tweet.region:
+            regional = self.regional.get(tweet.region)
+            if regional is None:
+                regional = self.regional.setdefault(tweet.region, RollingAggregates())
+            regional.add(subject, subj_type, tweet.sentiment, tweet.ts)
 
     @commit_after
     def create(self, subject: str, tweet: Tweet, type: SubjectType):
         c = self.db.conn.cursor()
         if not self.exists(subject):
             c.execute('INSERT INTO subjects VALUES(?, ?);', [subject, type.value])
+            self.known.put(subject, type.value)
 
-        c.execute('INSERT INTO tweet_subjects VALUES(?, ?);', [tweet.id, subject])
-        return Subject(subject, type)
+        c.execute('INSERT INTO tweet_subjects_%s VALUES(?, ?);' % self.db.tweets.partition(), [tweet.id, subject])
 
-    def top(self, n=10, sort='asc', subj_type=SubjectType.ALL):
-        c = self.db.conn.cursor()
+        subj_type = self.known.peek(subject, type.value)
+        c.execute(self.ROLLUP_UPSERT, [subject, hour_of(tweet.ts), tweet.region, subj_type, 1, tweet.sentiment or 0.0])
+        self.observe(subject, subj_type, tweet)
+        return Subject(subject, type)
 
-        query = self.BASE_QUERY
+    @metrics.timed(QUERIES, query='window')
+    def window(self, order, n=10, subj_type=SubjectType.ALL, hours=24, region=None):
+        """
+        Aggregates subjects over tweets from the last few hours, from the same start as the rolling aggregates
+        (aggregates.window_start), so both give the same answer.
+
+        :param order: ORDER BY clause over the sum and total columns
+        :param region: only count tweets routed to this region, or tweets from everywhere if None
+        :return: rows of (subject, type, sum, total, avg)
+        """
+        c = self.db.reader().cursor()
+        start = window_start(hours)
+
+        raw = self.BASE_QUERY
+        raw_params = [start]
         if subj_type != SubjectType.ALL:
-            query = query + " AND s.type = %d" % subj_type.value
-
-        c.execute(query +
-                  " GROUP BY ts.subject ORDER BY sum %s, total %s LIMIT %d" % (sort, sort, n))
-        return c.fetchall()
-
-    def trend(self, n=10, sort='asc', subj_type=SubjectType.ALL, trend_time=1):
-        c = self.db.conn.cursor()
-        subj = ''
+            raw = raw + " AND s.type = ?"
+            raw_params.append(subj_type.value)
+        if region is not None:
+            raw = raw + " AND ts.region = ?"
+            raw_params.append(region)
+
+        if hours < 24:
+            c.execute(raw + " GROUP BY ts.subject ORDER BY %s LIMIT ?" % order, raw_params + [n])
+            return c.fetchall()
+
+        # Whole hours are read from the rollup, and only the tweets of the first, partial, hour from the tweets
+        first_hour = hour_of(start) + 3600 if start % 3600 else start
+        rollup = self.ROLLUP_QUERY
+        params = [first_hour]
         if subj_type != SubjectType.ALL:
-            subj = '''AND s.type IS {}'''.format(subj_type.value)
-
-        query = '''
-
-                SELECT
-                    s.subject,
-                    s.type,
-                    SUM(t.sentiment) AS sumSent,
-                    COUNT(*) as cnt,
-                    AVG(t.sentiment) AS avgSent
-                
-                FROM tweet_subjects as ts
-                LEFT JOIN tweets t ON ts.tweet_id = t.id
-                LEFT JOIN subjects s on ts.subject = s.subject
-                WHERE DATETIME(time) >= DATETIME('now', '-{} hour')
-                {}
-                GROUP BY s.subject
-                ORDER BY cnt {} 
-                LIMIT {}
-                    '''.format(trend_time, subj, sort, n)
-        c.execute(query)
-        data = c.fetchall()
-        return data
-
-    def hot(self, n=10, sort='asc', subj_type=SubjectType.ALL):
-        c = self.db.conn.cursor()
+            rollup = rollup + " AND h.type = ?"
+            params.append(subj_type.value)
+        if region is not None:
+            rollup = rollup + " AND h.region = ?"
+            params.append(region)
+
+        query = """SELECT subject, type, sum(sum) as sum, sum(total) as total, sum(sum) / sum(total) as avg FROM (
+            %s GROUP BY h.subject UNION ALL %s AND ts.ts < ? GROUP BY ts.subject)
+            GROUP BY subject ORDER BY %s LIMIT ?""" % (rollup, raw, order)
+        c.execute(query, params + raw_params + [first_hour, n])
+        return c.fetchall()
 
-        query = self.BASE_QUERY
+    def ranked(self, key, n=10, sort='asc', subj_type=SubjectType.ALL, hours=24, region=None):
+        aggregates = self.aggregates if region is None else self.regional.get(region)
+        sort = direction(sort)
+        if aggregates is None:
+            # No tweets from the region since the aggregates were built
+            return []
+        return aggregates.rank(key, n, sort, None if subj_type == SubjectType.ALL else subj_type.value, hours)
+
+    @metrics.timed(QUERIES, query='top')
+    def top(self, n=10, sort='asc', subj_type=SubjectType.ALL, region=None):
+        if self.aggregates is not None:
+            return self.ranked(lambda s, c: (s, c), n, sort, subj_type, region=region)
+
+        sort = direction(sort)
+        return self.window("sum %s, total %s" % (sort, sort), n, subj_type, region=region)
+
+    @metrics.timed(QUERIES, query='trend')
+    def trend(self, n=10, sort='asc', subj_type=SubjectType.ALL, trend_time=1, region=None):
+        if self.aggregates is not None:
+            return self.ranked(lambda s, c: c, n, sort, subj_type, hours=trend_time, region=region)
+
+        return self.window("total %s" % direction(sort), n, subj_type, hours=trend_time, region=region)
+
+    @metrics.timed(QUERIES, query='hot')
+    def hot(self, n=10, sort='asc', subj_type=SubjectType.ALL, region=None):
+        if self.aggregates is not None:
+            return self.ranked(lambda s, c: c, n, sort, subj_type, region=region)
+
+        return self.window("total %s" % direction(sort), n, subj_type, region=region)
+
+    @metrics.timed(QUERIES, query='summaries')
+    def summaries(self, start: date, end: date, limit=10, sort='desc', at_least=1, subj_type=SubjectType.ALL,
+                  cursor=None, page_size=500):
+        """
+        Reads the top subjects of each day between start and end (inclusive), a page at a time. The subjects are ranked
+        within each day by a window function, so the whole range is a single query.
+
+        :param limit: how many subjects to keep per day, or -1 for all of them
+        :param sort: 'desc' ranks the most tweeted subjects first, 'asc' the least
+        :param at_least: only subjects with more than this many tweets on the day
+        :param cursor: the (day, rank) of the last row of the previous page, or None for the first page
+        :return: the page of rows of (subject, day, type, num_tweets, sum_sentiment, avg_sentiment, rank), ordered by
+            day then rank, and the cursor of the next page (None if this is the last page)
+        """
+        c = self.db.reader().cursor()
+
+        # Ranks are per day, so the days before the cursor's needn't be ranked again
+        first = start.isoformat() if cursor is None else max(start.isoformat(), cursor[0])
+        ranked = """SELECT subject, day, type, num_tweets, sum_sentiment, avg_sentiment,
+            ROW_NUMBER() OVER (PARTITION BY day ORDER BY num_tweets %s, subject) AS rank
+            FROM subject_summaries
+            WHERE day >= ? AND day <= ? AND num_tweets > ?""" % direction(sort)
+        params = [first, end.isoformat(), at_least]
         if subj_type != SubjectType.ALL:
-            query = query + " AND s.type = %d" % subj_type.value
+            ranked = ranked + " AND type = ?"
+            params.append(subj_type.value)
 
-        c.execute(query +
-                  " GROUP BY ts.subject ORDER BY total %s LIMIT %d" % (sort, n))
-        return c.fetchall()
+        q = "WITH ranked AS (%s) SELECT * FROM ranked WHERE (day, rank) > (?, ?)" % ranked
+        params += list(cursor) if cursor is not None else ['', 0]
+        if limit != -1:
+            q = q + " AND rank <= ?"
+            params.append(limit)
 
-    def summaries(self, days=7, limit=-1, sort='desc', at_least=1):
-        c = self.db.conn.cursor()
-        if not limit == -1:
+        c.execute(q + " ORDER BY day, rank LIMIT ?;", params + [page_size + 1])
+        rows = c.fetchall()
 
-            # In this case, we grab the top 'n' of each subject over the specified period.
-            # SQLite doesn't have a nice native support for this sort of 'group by limit' query, so I just repeat
-            # several small queries and aggregate the results.
+        page = rows[:page_size]
+        next_cursor = (page[-1][1], page[-1][6]) if len(rows) > page_size else None
 
-            data = []
+        return page, next_cursor
 
-            while days > 1:
-                q = """SELECT * from subject_summaries WHERE 
-                day >= date('now','-%d days') and day <= date('now', '-%d days') 
-                GROUP BY subject HAVING num_tweets > %d 
-                ORDER BY num_tweets %s LIMIT %d;""" % (days, days - 1, at_least, sort, limit)
-                c.execute(q)
-                data = data + [SubjectSummary.map_subject_summary(row) for row in c.fetchall()]
-                days = days - 1
+    def archive_last_24h(self):
+        """
+        Summarises yesterday (UTC), and appends the summary to the subject history, for the nightly job.
+        """
+        self.summarise(datetime.now(timezone.utc).date() - timedelta(days=1))
+
+    def summarise(self, day):
+        """
+        Summarises one UTC day into subject_summaries, and writes it into the subject history.
+        """
+        self.archive_day(day)
+        self.record_history(day)
+
+    def unsummarised_days(self, before):
+        """
+        :return: days earlier than the given one with hourly rollup rows that were never summarised, such as the days
+            of tweets backfilled from files
+        """
+        start = int(datetime(before.year, before.month, before.day, tzinfo=timezone.utc).timestamp())
+        c = self.db.conn.cursor()
+        c.execute("SELECT DISTINCT date(hour, 'unixepoch') AS day FROM subject_hourly WHERE hour < ? "
+                  "AND day NOT IN (SELECT day FROM summarised_days) ORDER BY day;", [start])
+        return [date.fromisoformat(row[0]) for row in c.fetchall()]
 
-            return data
-        else:
+    def record_history(self, day):
+        """
+        Writes one day of subject_summaries into the subject history.
 
-            # In the alternative case, we just dump everything from summaries. This could be a LOT of data.
+        :return: number of subjects written
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT subject, num_tweets, sum_sentiment FROM subject_summaries WHERE day = ?;', [day.isoformat()])
+        return self.db.history.record(day, c.fetchall())
 
-            q = """SELECT * from subject_summaries WHERE 
-                day >= date('now','-%d days')
-                GROUP BY subject HAVING num_tweets > %d 
-                ORDER BY num_tweets %s LIMIT %d""" % (days, at_least, sort, limit)
+    def backfill_history(self):
+        """
+        Writes every day of subject_summaries into the subject history.
 
-            c.execute(q)
-            return [SubjectSummary.map_subject_summary(row) for row in c.fetchall()]
+        :return: number of days written
+        """
+        c = self.db.conn.cursor()
+        c.execute('SELECT DISTINCT day FROM subject_summaries ORDER BY day;')
+        days = [date.fromisoformat(row[0]) for row in c.fetchall()]
+        for day in days:
+            self.record_history(day)
+        return len(days)
 
     @commit_after
-    def archive_last_24h(self):
+    def archive_day(self, day):
+        """
+        Writes the summary of one UTC day into subject_summaries, from the hourly rollup. Re-running it for the same
+        day replaces that day's rows.
+
+        :param day: datetime.date to summarise
+        """
         q = """INSERT INTO subject_summaries (subject, day, type, sum_sentiment, num_tweets, avg_sentiment) 
-        SELECT s.subject, date('now', '-1 day'), s.type, sum(t.sentiment) as sum, count(ts.subject) as total, avg(t.sentiment)
-        FROM tweet_subjects ts 
-        LEFT JOIN tweets t ON ts.tweet_id = t.id 
-        LEFT JOIN subjects s on ts.subject = s.subject
-        WHERE t.time >= date('now','-1 day') GROUP BY ts.subject HAVING total > 1 ORDER BY total DESC;"""
+        SELECT h.subject, ?, h.type, sum(h.sum_sentiment) as sum, sum(h.count) as total,
+        sum(h.sum_sentiment) / sum(h.count)
+        FROM subject_hourly h
+        WHERE h.hour >= ? AND h.hour < ? GROUP BY h.subject HAVING total > 1
+        ON CONFLICT (subject, day) DO UPDATE SET type = excluded.type, num_tweets = excluded.num_tweets, 
+        sum_sentiment = excluded.sum_sentiment, avg_sentiment = excluded.avg_sentiment;"""
 
+        start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+        c = self.db.conn.cursor()
+        c.execute(q, [day.isoformat(), start, start + 24 * 3600])
+        c.execute('INSERT OR IGNORE INTO summarised_days (day) VALUES(?);', [day.isoformat()])
+
+    def backfill_hourly(self):
+        """
+        Rebuilds the hourly rollup from every stored tweet, in one transaction. Rollup rows from before the oldest stored
+        tweet are kept, as their tweets may have been expired.
+
+        :return: number of rollup rows written
+        """
+        with self.db.lock, WRITES.time(op='SubjectRepo.backfill_hourly'):
+            c = self.db.conn.cursor()
+            c.execute('BEGIN;')
+            try:
+                c.execute('DELETE FROM subject_hourly WHERE hour >= (SELECT min(ts) - min(ts) % 3600 FROM tweets);')
+                c.execute("""INSERT INTO subject_hourly (subject, hour, region, type, count, sum_sentiment)
+                    SELECT ts.subject, t.ts - t.ts % 3600 as hour, t.region, s.type, count(*), total(t.sentiment)
+                    FROM tweets t
+                    CROSS JOIN tweet_subjects ts ON ts.tweet_id = t.id
+                    CROSS JOIN subjects s on ts.subject = s.subject
+                    WHERE t.ts IS NOT NULL GROUP BY ts.subject, hour, t.region;""")
+                rows = c.rowcount
+                c.execute('COMMIT;')
+            except Exception:
+                c.execute('ROLLBACK;')
+                raise
+            self.db.generation += 1
+
+        return rows
+
+    @metrics.timed(QUERIES, query='find_by_tweet')
+    def find_by_tweet(self, tweet_id):
+        """
+        :return: dict of SubjectType to the distinct subjects stored for a tweet
+        """
         c = self.db.conn.cursor()
-        c.execute(q)
+        c.execute('SELECT DISTINCT ts.subject, s.type FROM tweet_subjects ts CROSS JOIN subjects s ON s.subject = ts.subject '
+                  'WHERE ts.tweet_id = ?;', [tweet_id])
+
+        found = {}
+        for subject, subj_type in c.fetchall():
+            found.setdefault(SubjectType(subj_type), []).append(subject)
+        return found
 
     def exists(self, subject: str):
+        if subject in self.known:
+            return True
+
         c = self.db.conn.cursor()
-        c.execute('SELECT count(*) FROM subjects s WHERE s.subject = ?;', [subject])
+        c.execute('SELECT type FROM subjects s WHERE s.subject = ? LIMIT 1;', [subject])
+        row = c.fetchone()
+        if row is None:
+            return False
 
-        return c.fetchone()[0] > 0
+        self.known.put(subject, row[0])
+        return True
+
+
+class BatchWriter:
+    """
+    Write-behind unit of work for ingest. Rather than committing every user, tweet and subject as it is created, the
+    rows for a batch of tweets are collected here and written with executemany in a single transaction. A flush happens
+    once flush_size tweets are pending, flush_interval seconds after the oldest pending write, and at shutdown. If the
+    batch can't be written, its tweets are written one at a time, and those which still fail are dropped.
+    """
+
+    def __init__(self, db, flush_size=200, flush_interval=5.0):
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.oldest = None
+        self._clear()
+
+        thread = threading.Thread(target=self._flush_daemon, args=())
+        thread.daemon = True
+        thread.start()
+
+        atexit.register(self.flush)
+
+    def _clear(self):
+        self.tweets = {}
+        self.subjects = {}
+        self.tweet_subjects = []
+        self.observations = []
+        self.oldest = None
+
+    def _flush_daemon(self):
+        while True:
+            time.sleep(min(self.flush_interval, 1))
+            if self.oldest is not None and time.time() - self.oldest >= self.flush_interval:
+                try:
+                    self.flush()
+                except Exception as e:
+                    metrics.error('flush', e)
+                    logging.exception(e)
+
+    def pending(self, _id):
+        return _id in self.tweets
+
+    def find(self, _id):
+        """
+        :return: the pending (not yet flushed) tweet with the given id, or None
+        """
+        return self.tweets.get(_id)
+
+    def subjects_of(self, _id):
+        """
+        :return: dict of SubjectType to the distinct subjects pending for a tweet
+        """
+        with self.lock:
+            found = {}
+            for tweet_id, subject in self.tweet_subjects:
+                if tweet_id == _id and subject not in found:
+                    found[subject] = SubjectType(self.subjects[subject])
+
+        subjects = {}
+        for subject, subj_type in found.items():
+            subjects.setdefault(subj_type, []).append(subject)
+        return subjects
+
+    def add(self, tweet: Tweet, subjects):
+        """
+        Queues a new tweet, its user and its subjects.
+
+        :param tweet: tweet to write; its user is resolved by name when flushed
+        :param subjects: dict of SubjectType to lists of subjects found in the tweet
+        """
+        with self.lock:
+            self.tweets[tweet.id] = tweet
+            PENDING.set(len(self.tweets))
+            self.add_subjects(tweet, subjects)
+
+    def add_subjects(self, tweet: Tweet, subjects):
+        """
+        Queues subjects for a tweet, which may be pending or already stored.
+        """
+        with self.lock:
+            for subj_type, found in subjects.items():
+                for subject in found:
+                    self.subjects.setdefault(subject, subj_type.value)
+                    self.tweet_subjects.append((tweet.id, subject))
+                    self.observations.append((subject, tweet))
+
+            if self.oldest is None:
+                self.oldest = time.time()
+
+        if len(self.tweets) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.oldest is None:
+                return
+
+            try:
+                self._write(list(self.tweets.values()), self.tweet_subjects, self.observations)
+            except Exception as e:
+                metrics.error('flush', e)
+                logging.exception(e)
+                self._write_each()
+
+            self._clear()
+            PENDING.set(0)
+
+    def _write_each(self):
+        """
+        Writes the pending tweets one at a time, with their subjects, after writing them all at once failed. A tweet
+        which still can't be written is dropped, rather than left pending to fail every later flush.
+        """
+        tweet_subjects, observations = {}, {}
+        for row in self.tweet_subjects:
+            tweet_subjects.setdefault(row[0], []).append(row)
+        for row in self.observations:
+            observations.setdefault(row[1].id, []).append(row)
+
+        dropped = 0
+        # Subjects can be pending for stored tweets too
+        for _id in dict.fromkeys(list(self.tweets) + list(tweet_subjects)):
+            tweet = self.tweets.get(_id)
+            try:
+                self._write([tweet] if tweet is not None else [], tweet_subjects.get(_id, []), observations.get(_id, []))
+            except Exception as e:
+                dropped += 1
+                logging.error('Dropping tweet %s, which could not be written: %s', _id, e)
+
+        DROPPED.inc(dropped)
+        if dropped:
+            logging.warning('Dropped %d of %d tweets from a failed flush', dropped, len(self.tweets))
+
+    def _write(self, tweets, tweet_subjects, observations):
+        """
+        Writes tweets and subjects in one transaction, then updates the repository caches and aggregates.
+
+        :param tweets: list of Tweets
+        :param tweet_subjects: list of (tweet id, subject)
+        :param observations: list of (subject, Tweet) for the rollup
+        """
+        # Identities the repository caches already know about don't need an insert
+        users = [(name, name) for name in {t.user.name for t in tweets} if self.db.users.ids.get(name) is None]
+        rows = [(t.id, t.user.name, t.tweet, t.sentiment, t.time, t.ts, t.region, t.lat, t.long) for t in tweets]
+        subjects = [(subject, self.subjects[subject]) for subject in {subject for _, subject in tweet_subjects}
+                    if subject not in self.db.subjects.known]
+
+        # Pre-aggregate the rollup, so each (subject, hour, region) is upserted once per flush
+        hourly = {}
+        for subject, tweet in observations:
+            subj_type = self.db.subjects.known.peek(subject, self.subjects[subject])
+            cell = hourly.setdefault((subject, hour_of(tweet.ts), tweet.region), [subj_type, 0, 0.0])
+            cell[1] += 1
+            cell[2] += tweet.sentiment or 0.0
+
+        # And the heatmap tiles, each (cell, hour, region) once per flush
+        points = [row for row in (TweetRepo.point_row(t) for t in tweets) if row is not None]
+        tiles = {}
+        for point in points:
+            tile = tiles.setdefault((point[8][:TweetRepo.TILE_PRECISION], hour_of(point[5]), point[7]), [0, 0.0])
+            tile[0] += 1
+            tile[1] += point[6]
+
+        with self.db.lock, WRITES.time(op='BatchWriter.flush'):
+            partition = self.db.tweets.partition()
+            c = self.db.conn.cursor()
+            c.execute('BEGIN;')
+            try:
+                c.executemany('INSERT INTO users (name) SELECT ? WHERE NOT EXISTS '
+                              '(SELECT 1 FROM users u WHERE u.name = ?);', users)
+                c.executemany('INSERT OR IGNORE INTO tweets_%s (id, user_id, tweet, sentiment, time, ts, region, '
+                              'lat, long) VALUES(?, (SELECT id FROM users u WHERE u.name = ? LIMIT 1), ?, ?, ?, ?, '
+                              '?, ?, ?);' % partition, rows)
+                c.executemany(TweetRepo.POINT_INSERT % partition, points)
+                c.executemany('INSERT OR IGNORE INTO subjects VALUES(?, ?);', subjects)
+                c.executemany('INSERT INTO tweet_subjects_%s VALUES(?, ?);' % partition, tweet_subjects)
+                c.executemany(SubjectRepo.ROLLUP_UPSERT,
+                              [(subject, hour, region, t, count, total)
+                               for (subject, hour, region), (t, count, total) in hourly.items()])
+                c.executemany(TweetRepo.TILE_UPSERT,
+                              [(cell, hour, region, count, total)
+                               for (cell, hour, region), (count, total) in tiles.items()])
+                c.execute('COMMIT;')
+            except Exception:
+                c.execute('ROLLBACK;')
+                raise
+            self.db.generation += 1
+
+        WRITTEN.inc(len(rows), table='tweets')
+        WRITTEN.inc(len(tweet_subjects), table='tweet_subjects')
+        WRITTEN.inc(len(hourly), table='subject_hourly')
+        WRITTEN.inc(len(points), table='tweet_points')
+        WRITTEN.inc(len(tiles), table='geo_hourly')
+
+        for tweet in tweets:
+            self.db.tweets.seen.add(tweet.id)
+        for name, _ in users:
+            self.db.users.find_id(name)
+        for subject, subj_type in subjects:
+            self.db.subjects.known.put(subject, subj_type)
+        for subject, tweet in observations:
+            self.db.subjects.observe(subject, self.db.subjects.known.peek(subject, self.subjects[subject]), tweet)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Geohashes: base 32 strings naming cells of a grid over the globe, where each character divides the cell of its prefix
+into 32. A tweet's location is stored as a geohash at MAX_PRECISION, so binning at any coarser precision is just a
+prefix of it.
+"""
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+DECODE = {c: i for i, c in enumerate(BASE32)}
+
+# About 5m by 5m
+MAX_PRECISION = 9
+
+
+def encode(lat, long, precision=MAX_PRECISION):
+    """
+    :return: the geohash of the cell containing the point
+    """
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate between longitude and latitude, longitude first
+
+    while len(chars) < precision:
+        if even:
+            mid = (west + east) / 2
+            if long >= mid:
+                value = value * 2 + 1
+                west = mid
+            else:
+                value = value * 2
+                east = mid
+        else:
+            mid = (south + north) / 2
+            if lat >= mid:
+                value = value * 2 + 1
+                south = mid
+            else:
+                value = value * 2
+                north = mid
+        even = not even
+
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+
+    return ''.join(chars)
+
+
+def bounds(cell):
+    """
+    :return: (south, west, north, east) of the cell
+    """
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    even = True
+
+    for c in cell:
+        value = DECODE[c]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (west + east) / 2
+                if bit:
+                    west = mid
+                else:
+                    east = mid
+            else:
+                mid = (south + north) / 2
+                if bit:
+                    south = mid
+                else:
+                    north = mid
+            even = not even
+
+    return south, west, north, east
+
+
+def centre(cell):
+    """
+    :return: (lat, long) of the centre of the cell
+    """
+    south, west, north, east = bounds(cell)
+    return (south + north) / 2, (west + east) / 2
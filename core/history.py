@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar daily history of every summarised subject, so a subject's sentiment over months is read as a few contiguous
+slices rather than by filtering subject_summaries.
+"""
+
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from core import metrics
+
+APPENDS = metrics.histogram('history_append_seconds', 'Time to append a day to the subject history')
+READS = metrics.histogram('history_read_seconds', 'Time to read and downsample one subject history')
+
+RESOLUTIONS = ('day', 'week', 'month')
+
+# Longest history read at once
+MAX_DAYS = 10 * 366
+
+
+class SubjectHistory:
+    """
+    Daily tweet counts and sentiment sums per subject, in memory-mapped files under directory. Each year has one file
+    per column (counts-<yyyy>.u32 and sums-<yyyy>.f32), holding a row of DAYS values per subject, so one subject's year
+    is contiguous. Subjects are given rows in order of first appearance, listed one per line in subjects.jsonl; a new
+    subject extends the files, and rows of days not yet written read as zero (on disk the files stay sparse).
+
+    record writes a day's subjects, from the nightly summary. Re-recording a day overwrites the subjects given and leaves
+    the rest: a day's summaries only ever gain subjects, as backfills add tweets to it, so none are left stale. Only the
+    pages of the rows written are touched, so a day costs the same however many subjects have been seen.
+    """
+
+    DAYS = 366
+    COLUMNS = {'counts': np.uint32, 'sums': np.float32}
+    SUFFIXES = {np.uint32: 'u32', np.float32: 'f32'}
+
+    def __init__(self, directory='data/history'):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # subject -> row
+        self.rows = {}
+        # (column, year) -> read-only memory map, reopened when its file grows
+        self.maps = {}
+
+        os.makedirs(directory, exist_ok=True)
+        index = os.path.join(directory, 'subjects.jsonl')
+        if os.path.isfile(index):
+            with open(index, encoding='utf-8') as f:
+                for line in f:
+                    self.rows.setdefault(json.loads(line), len(self.rows))
+
+    def path(self, column, year):
+        dtype = self.COLUMNS[column]
+        return os.path.join(self.directory, '%s-%d.%s' % (column, year, self.SUFFIXES[dtype]))
+
+    def row_bytes(self, column):
+        return self.DAYS * np.dtype(self.COLUMNS[column]).itemsize
+
+    def open(self, column, year, mode='r'):
+        """
+        :return: the column's memory map for the year, of shape (subjects, DAYS), or None if nothing is stored for it
+        """
+        path = self.path(column, year)
+        if not os.path.isfile(path):
+            return None
+
+        rows = os.path.getsize(path) // self.row_bytes(column)
+        if rows == 0:
+            return None
+
+        if mode != 'r':
+            return np.memmap(path, dtype=self.COLUMNS[column], mode=mode, shape=(rows, self.DAYS))
+
+        # Read maps are shared, so they see later writes, and only need reopening for new rows
+        data = self.maps.get((column, year))
+        if data is None or data.shape[0] != rows:
+            data = self.maps[(column, year)] = np.memmap(path, dtype=self.COLUMNS[column], mode='r',
+                                                         shape=(rows, self.DAYS))
+        return data
+
+    def record(self, day, totals):
+        """
+        Writes one day of the history.
+
+        :param day: datetime.date the totals are for
+        :param totals: list of (subject, count, sum_sentiment); subjects not in it keep what was recorded for the day
+        :return: number of subjects written
+        """
+        with self.lock, APPENDS.time():
+            new = []
+            for subject, _, _ in totals:
+                if subject not in self.rows:
+                    self.rows[subject] = len(self.rows)
+                    new.append(subject)
+
+            if new:
+                with open(os.path.join(self.directory, 'subjects.jsonl'), 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(subject) + '\n' for subject in new)
+
+            rows = np.array([self.rows[subject] for subject, _, _ in totals], dtype=np.int64)
+            values = {'counts': np.array([count for _, count, _ in totals], dtype=np.uint32),
+                      'sums': np.array([total for _, _, total in totals], dtype=np.float32)}
+            column_of_day = day.timetuple().tm_yday - 1
+
+            for column in self.COLUMNS:
+                path = self.path(column, day.year)
+                size = len(self.rows) * self.row_bytes(column)
+                # Growing a file by truncate leaves the new rows as holes, which read as zeros
+                with open(path, 'ab') as f:
+                    if f.tell() < size:
+                        f.truncate(size)
+
+                data = self.open(column, day.year, mode='r+')
+                data[rows, column_of_day] = values[column]
+                data.flush()
+                del data
+
+        return len(totals)
+
+    def series(self, subject, start, end):
+        """
+        :return: daily (counts, sums) arrays of the subject from start to end inclusive, or None if it has no history
+        """
+        row = self.rows.get(subject)
+        if row is None:
+            return None
+
+        days = (end - start).days + 1
+        counts = np.zeros(max(days, 0), dtype=np.uint32)
+        sums = np.zeros(max(days, 0), dtype=np.float64)
+
+        for year in range(start.year, end.year + 1):
+            first = max(start, date(year, 1, 1))
+            last = min(end, date(year, 12, 31))
+            if first > last:
+                continue
+
+            # Only this subject's row, and only the days wanted, are read from each year's files
+            a, b = first.timetuple().tm_yday - 1, last.timetuple().tm_yday
+            i = (first - start).days
+            for column, out in (('counts', counts), ('sums', sums)):
+                data = self.open(column, year)
+                if data is not None and row < data.shape[0]:
+                    out[i:i + b - a] = data[row, a:b]
+
+        return counts, sums
+
+    def history(self, subject, start, end, resolution='day'):
+        """
+        Reads a subject's history, summed into periods of a day, a week (starting on Monday) or a calendar month.
+
+        :return: list of (first day of the period, count, sum_sentiment), one per period overlapping start to end, or
+            None if the subject has no history
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError('Resolution must be one of %s. (%s)' % (', '.join(RESOLUTIONS), resolution))
+        if end < start:
+            raise ValueError('The history ends before it starts. (%s to %s)' % (start, end))
+        if (end - start).days >= MAX_DAYS:
+            raise ValueError('At most %d days of history can be read at once. (%s to %s)' % (MAX_DAYS, start, end))
+
+        with READS.time():
+            series = self.series(subject, start, end)
+            if series is None:
+                return None
+            counts, sums = series
+
+            periods, offsets = [], []
+            begins = period_start(start, resolution)
+            while begins <= end:
+                periods.append(begins)
+                offsets.append(max((begins - start).days, 0))
+                begins = next_period(begins, resolution)
+
+            counts = np.add.reduceat(counts.astype(np.int64), offsets)
+            sums = np.add.reduceat(sums, offsets)
+
+        return [(begins, int(count), float(total)) for begins, count, total in zip(periods, counts, sums)]
+
+
+def period_start(day, resolution):
+    if resolution == 'week':
+        return day - timedelta(days=day.weekday())
+    if resolution == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(begins, resolution):
+    if resolution == 'day':
+        return begins + timedelta(days=1)
+    if resolution == 'week':
+        return begins + timedelta(days=7)
+    if begins.month == 12:
+        return date(begins.year + 1, 1, 1)
+    return date(begins.year, begins.month + 1, 1)
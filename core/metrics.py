@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide counters, gauges and latency histograms for ingest and queries, rendered in the Prometheus text format by
+/api/metrics. Metrics are registered at import time by the modules that record them, e.g.:
+
+    ANNOTATE = metrics.histogram('annotate_seconds', 'Time to annotate a batch of tweets')
+
+    with ANNOTATE.time():
+        ...
+"""
+
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'sitegeist_'
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.values = {}  # tuple of label values -> value
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('%s takes labels %s. (%s)' % (self.name, self.labels, sorted(labels)))
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                                 for k, v in pairs)
+
+    def samples(self):
+        """
+        :return: list of (name, label text, value) lines
+        """
+        with self.lock:
+            return [(self.name, self.label_text(key), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.doc), '# TYPE %s %s' % (self.name, self.kind)]
+        lines += ['%s%s %s' % (name, labels, format_value(value)) for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value which goes up and down. Either set it, or give it a function which is read at every scrape.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labels=(), func=None):
+        super().__init__(name, doc, labels)
+        self.func = func
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.func is not None:
+            try:
+                return [(self.name, '', self.func())]
+            except Exception:
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum of observed values
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+
+        samples = []
+        for key, counts in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                samples.append((self.name + '_bucket', self.label_text(key, [('le', format_value(bound))]), count))
+            samples.append((self.name + '_bucket', self.label_text(key, [('le', '+Inf')]), counts[-2]))
+            samples.append((self.name + '_count', self.label_text(key), counts[-2]))
+            samples.append((self.name + '_sum', self.label_text(key), counts[-1]))
+        return samples
+
+
+class Rate:
+    """
+    Events per second over the last window seconds, from per-second buckets.
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        self.counts = {}  # epoch second -> events
+        self.lock = threading.Lock()
+
+    def add(self, amount=1):
+        now = int(time.time())
+        with self.lock:
+            self.counts[now] = self.counts.get(now, 0) + amount
+            if len(self.counts) > self.window * 2:
+                for second in [s for s in self.counts if s <= now - self.window]:
+                    del self.counts[second]
+
+    def per_second(self):
+        since = int(time.time()) - self.window
+        with self.lock:
+            return sum(count for second, count in self.counts.items() if second > since) / self.window
+
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def counter(name, doc, labels=()):
+    return register(Counter(name, doc, labels))
+
+
+def gauge(name, doc, labels=(), func=None):
+    return register(Gauge(name, doc, labels, func))
+
+
+def histogram(name, doc, labels=(), buckets=BUCKETS):
+    return register(Histogram(name, doc, labels, buckets))
+
+
+def render():
+    """
+    :return: every registered metric, in the Prometheus text exposition format
+    """
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def timed(histogram, **labels):
+    """
+    Decorator which observes the duration of each call of the function in the histogram.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Shared by the modules which record them
+ERRORS = counter('errors_total', 'Exceptions caught and logged, by where they were caught and their type',
+                 ['stage', 'type'])
+STARTUP = gauge('startup_phase_seconds', 'Seconds taken by each phase of startup', ['phase'])
+
+
+def error(stage, e):
+    ERRORS.inc(stage=stage, type=type(e).__name__)
+
+
+@contextmanager
+def startup_phase(phase):
+    """
+    Times a phase of startup, which is logged and kept for /api/ready and /api/metrics.
+    """
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    STARTUP.set(seconds, phase=phase)
+    logging.info('Startup: %s took %.2fs', phase, seconds)
+
+
+def startup_phases():
+    """
+    :return: dict of each startup phase finished so far to its duration in seconds
+    """
+    with STARTUP.lock:
+        return {key[0]: round(seconds, 3) for key, seconds in STARTUP.values.items()}
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Background lookup of the parent tweets of replies and quotes, so a slow REST call never stalls ingest.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from twitter import TwitterError
+
+from core import metrics
+
+# Twitter's error code for an exhausted rate limit window
+RATE_LIMITED = 88
+
+LOOKUPS = metrics.counter('parent_lookups_total', 'Bulk parent tweet lookups, by outcome', ['result'])
+LOOKUP_TIME = metrics.histogram('parent_lookup_seconds', 'Time taken by each bulk parent tweet lookup')
+PENDING = metrics.gauge('parent_lookups_pending', 'Parent tweet ids waiting to be looked up')
+
+
+class ParentResolver:
+    """
+    Collects the ids of unknown parent tweets and looks them up in bulk (statuses/lookup takes up to 100 ids per call)
+    on a background thread. An id already waiting for a lookup is not requested twice; instead its count of waiting
+    replies goes up. Calls are paced to stay inside the endpoint's rate limit, and a rate limited batch is retried once
+    the window has passed.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, lookup, deliver, max_wait=2.0, limit=900, window=15 * 60):
+        """
+        :param lookup: function of a list of ids, returning a dict of id to twitter Status (or None if unavailable)
+        :param deliver: function of (status, replies) called on the background thread for each parent found, where
+            replies is how many replies or quotes were waiting on it
+        :param max_wait: seconds an id waits for its batch to fill before it is looked up anyway
+        :param limit: calls allowed per rate limit window
+        :param window: length of the rate limit window in seconds
+        """
+        self.lookup = lookup
+        self.deliver = deliver
+        self.max_wait = max_wait
+        self.interval = window / limit
+        self.window = window
+        self.pending = OrderedDict()  # id -> replies waiting on it, in order of first request
+        self.in_flight = {}  # id -> replies waiting on it, for the batch being looked up
+        self.oldest = None
+        self.last_call = 0
+        self.cond = threading.Condition()
+
+        thread = threading.Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+
+    def request(self, _id):
+        """
+        Queues a parent tweet id for lookup.
+
+        :return: True if the id is new, False if it was already waiting for a lookup
+        """
+        with self.cond:
+            if _id in self.in_flight:
+                self.in_flight[_id] += 1
+                return False
+            if _id in self.pending:
+                self.pending[_id] += 1
+                return False
+
+            self.pending[_id] = 1
+            if self.oldest is None:
+                self.oldest = time.time()
+            self.cond.notify()
+            return True
+
+    def next_batch(self):
+        """
+        Blocks until an id is pending, then until either BATCH_SIZE ids are pending or the oldest has waited max_wait
+        seconds, and moves up to BATCH_SIZE of them in flight.
+        """
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+
+            while len(self.pending) < self.BATCH_SIZE:
+                remaining = self.oldest + self.max_wait - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+            while self.pending and len(self.in_flight) < self.BATCH_SIZE:
+                _id, replies = self.pending.popitem(last=False)
+                self.in_flight[_id] = replies
+            self.oldest = time.time() if self.pending else None
+            PENDING.set(len(self.pending))
+
+            return list(self.in_flight)
+
+    def run(self):
+        while True:
+            ids = self.next_batch()
+
+            wait = self.last_call + self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_call = time.time()
+
+            try:
+                with LOOKUP_TIME.time():
+                    found = self.lookup(ids)
+            except TwitterError as te:
+                if rate_limited(te):
+                    LOOKUPS.inc(result='rate_limited')
+                    logging.warning('Parent lookup rate limited, retrying in %d seconds', self.window)
+                    self.retry()
+                    time.sleep(self.window)
+                else:
+                    LOOKUPS.inc(result='error')
+                    logging.error('Parent lookup failed: %s', te.message)
+                    self.finish()
+                continue
+            except Exception as e:
+                LOOKUPS.inc(result='error')
+                metrics.error('parents', e)
+                logging.exception(e)
+                self.finish()
+                continue
+
+            LOOKUPS.inc(result='ok')
+
+            for _id, replies in self.finish().items():
+                status = found.get(_id)
+                if status is None:
+                    continue
+                try:
+                    self.deliver(status, replies)
+                except Exception as e:
+                    metrics.error('parents', e)
+                    logging.exception(e)
+
+    def finish(self):
+        """
+        :return: the in flight ids and their reply counts, which are no longer in flight
+        """
+        with self.cond:
+            done, self.in_flight = self.in_flight, {}
+            return done
+
+    def retry(self):
+        """
+        Puts the in flight ids back at the front of the queue.
+        """
+        with self.cond:
+            for _id, replies in self.pending.items():
+                self.in_flight[_id] = self.in_flight.get(_id, 0) + replies
+            self.pending, self.in_flight = OrderedDict(self.in_flight), {}
+            if self.oldest is None:
+                self.oldest = time.time()
+
+
+def rate_limited(error):
+    messages = error.message if isinstance(error.message, list) else [error.message]
+    return any(isinstance(m, dict) and m.get('code') == RATE_LIMITED for m in messages)
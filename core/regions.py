@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Named geofences. All regions share one filter stream (the stream takes up to 25 bounding boxes), and each tweet is
+routed to a region by its coordinates, or failing that by its place.
+"""
+
+
+class Region:
+    """
+    A named bounding box. The corners can be given in either order.
+    """
+
+    def __init__(self, name, lat1, long1, lat2, long2):
+        if not name:
+            raise ValueError('A region needs a name.')
+        if lat1 > 90 or lat1 < -90 or lat2 > 90 or lat2 < -90:
+            raise ValueError('Latitude ranges from -90 to 90. (%s)' % name)
+        if long1 > 180 or long1 < -180 or long2 > 180 or long2 < -180:
+            raise ValueError('Longitude ranges from -180 to 180. (%s)' % name)
+
+        self.name = name
+        self.south, self.north = min(lat1, lat2), max(lat1, lat2)
+        self.west, self.east = min(long1, long2), max(long1, long2)
+
+    def contains(self, lat, long):
+        return self.south <= lat <= self.north and self.west <= long <= self.east
+
+    def overlap(self, south, west, north, east):
+        """
+        :return: area of the intersection with another box, in square degrees
+        """
+        height = min(self.north, north) - max(self.south, south)
+        width = min(self.east, east) - max(self.west, west)
+        return height * width if height >= 0 and width >= 0 else 0.0
+
+    def locations(self):
+        """
+        :return: the box as the stream's locations parameter takes it, south west corner first, longitude first
+        """
+        return ["%f,%f" % (self.west, self.south), "%f,%f" % (self.east, self.north)]
+
+    def corners(self):
+        """
+        :return: [[south, west], [north, east]], as the dashboard map takes bounds
+        """
+        return [[self.south, self.west], [self.north, self.east]]
+
+
+def bounds(regions):
+    """
+    :return: corners of the box enclosing all the regions
+    """
+    return [[min(r.south for r in regions), min(r.west for r in regions)],
+            [max(r.north for r in regions), max(r.east for r in regions)]]
+
+
+def point(tweet):
+    """
+    :param tweet: raw tweet dict, as received from the stream
+    :return: (lat, long) of the tweet's exact coordinates, or None
+    """
+    coordinates = (tweet.get('coordinates') or {}).get('coordinates')
+    if not coordinates:
+        return None
+    return coordinates[1], coordinates[0]
+
+
+def place_box(tweet):
+    """
+    :return: (south, west, north, east) of the tweet's place, or None
+    """
+    box = ((tweet.get('place') or {}).get('bounding_box') or {}).get('coordinates')
+    if not box:
+        return None
+    longs = [p[0] for p in box[0]]
+    lats = [p[1] for p in box[0]]
+    return min(lats), min(longs), max(lats), max(longs)
+
+
+def location(tweet):
+    """
+    :return: (lat, long) of the tweet's exact coordinates, otherwise of the centre of its place, or None if it has
+        neither
+    """
+    exact = point(tweet)
+    if exact is not None:
+        return exact
+
+    box = place_box(tweet)
+    if box is not None:
+        south, west, north, east = box
+        return (south + north) / 2, (west + east) / 2
+
+    return None
+
+
+def route(regions, tweet):
+    """
+    Finds the region a tweet belongs to: the first containing its exact coordinates, otherwise the one containing the
+    centre of its place's bounding box, otherwise the one its place overlaps most. A tweet read back from an archive
+    keeps the region it was stored with.
+
+    :param tweet: raw tweet dict, as received from the stream
+    :return: the region's name, or '' if the tweet is in none of them
+    """
+    if 'region' in tweet:
+        return tweet['region']
+
+    exact = point(tweet)
+    if exact is not None:
+        for region in regions:
+            if region.contains(*exact):
+                return region.name
+
+    box = place_box(tweet)
+    if box is not None:
+        south, west, north, east = box
+        for region in regions:
+            if region.contains((south + north) / 2, (west + east) / 2):
+                return region.name
+
+        overlaps = [(region.overlap(south, west, north, east), region.name) for region in regions]
+        best = max(overlaps, default=(0.0, ''))
+        if best[0] > 0:
+            return best[1]
+
+    return ''
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Sentence sentiment scoring. TweetProcessor scores through the SentimentScorer interface, so another backend (a
+different lexicon, or a model) only has to implement score_batch.
+"""
+
+import string
+
+from nltk.sentiment.vader import (B_DECR, BOOSTER_DICT, C_INCR, N_SCALAR, NEGATE, PUNC_LIST, SPECIAL_CASE_IDIOMS,
+                                  SentimentIntensityAnalyzer, normalize)
+
+PUNCTUATION = string.punctuation
+PUNC_SET = frozenset(PUNC_LIST)
+
+
+class SentimentScorer:
+    """
+    Scores sentences from -1 (most negative) to 1 (most positive).
+    """
+
+    def score_batch(self, sentences):
+        """
+        :param sentences: list of sentence strings
+        :return: list of scores, in the same order
+        """
+        raise NotImplementedError()
+
+    def score(self, sentence):
+        return self.score_batch([sentence])[0]
+
+
+class NltkVaderScorer(SentimentScorer):
+    """
+    NLTK's VADER, one polarity_scores call per sentence. Kept as the reference VaderScorer is checked against.
+    """
+
+    def __init__(self):
+        self.analyser = SentimentIntensityAnalyzer()
+
+    def score_batch(self, sentences):
+        return [self.analyser.polarity_scores(sentence)['compound'] for sentence in sentences]
+
+
+class VaderScorer(SentimentScorer):
+    """
+    The VADER compound score, equal to NLTK's polarity_scores(sentence)['compound'] for every sentence, including its
+    quirks (a repeated word is scored in the context of its first occurrence, and the 'but' rule rescales by value).
+
+    NLTK builds a dict of every word in the sentence joined to every punctuation mark to strip punctuation, looks up
+    each word's position with list.index, and lowercases each word many times over. Here each word is stripped, lowered
+    and looked up in the lexicon once, and the neg, neu and pos proportions aren't computed at all.
+    """
+
+    def __init__(self):
+        self.lexicon = SentimentIntensityAnalyzer().lexicon
+        self.boosters = BOOSTER_DICT
+        self.negations = frozenset(NEGATE)
+        self.idioms = SPECIAL_CASE_IDIOMS
+
+    def score_batch(self, sentences):
+        return [self.compound(sentence) for sentence in sentences]
+
+    @staticmethod
+    def words(text):
+        """
+        :return: the words of the text longer than one character, with a leading or trailing run of punctuation
+            removed where NLTK's SentiText would remove it
+        """
+        words = []
+        for word in text.split():
+            if len(word) < 2:
+                continue
+
+            if word[0] in PUNCTUATION or word[-1] in PUNCTUATION:
+                core = word.lstrip(PUNCTUATION)
+                lead = word[:len(word) - len(core)]
+                stripped = core.rstrip(PUNCTUATION)
+                trail = core[len(stripped):]
+
+                # Only a known punctuation run on one side only of a word without any other punctuation is removed
+                if (bool(lead) != bool(trail)) and (lead or trail) in PUNC_SET and len(stripped) > 1 and \
+                        not any(c in PUNCTUATION for c in stripped):
+                    word = stripped
+
+            words.append(word)
+        return words
+
+    def compound(self, text):
+        words = self.words(text)
+        if not words:
+            return 0.0
+
+        lexicon = self.lexicon
+        lowers = [word.lower() for word in words]
+        known = [lower in lexicon for lower in lowers]
+        negated = [lower in self.negations or "n't" in lower for lower in lowers]
+        uppers = sum(1 for word in words if word.isupper())
+        is_cap_diff = 0 < len(words) - uppers < len(words)
+
+        first = {}
+        for i, word in enumerate(words):
+            first.setdefault(word, i)
+
+        sentiments = []
+        for word in words:
+            i = first[word]
+            lower = lowers[i]
+
+            if lower in self.boosters or (lower == 'kind' and i < len(words) - 1 and lowers[i + 1] == 'of'):
+                sentiments.append(0)
+                continue
+            if not known[i]:
+                sentiments.append(0)
+                continue
+
+            valence = lexicon[lower]
+            if is_cap_diff and word.isupper():
+                valence = valence + C_INCR if valence > 0 else valence - C_INCR
+
+            for start_i in range(0, 3):
+                j = i - (start_i + 1)
+                if j < 0 or known[j]:
+                    continue
+
+                s = self.scalar_inc_dec(words[j], lowers[j], valence, is_cap_diff)
+                if start_i == 1 and s != 0:
+                    s = s * 0.95
+                if start_i == 2 and s != 0:
+                    s = s * 0.9
+                valence = valence + s
+                valence = self.never_check(valence, words, negated, start_i, i)
+                if start_i == 2:
+                    valence = self.idioms_check(valence, words, i)
+
+            sentiments.append(self.least_check(valence, lowers, known, i))
+
+        sentiments = self.but_check(words, sentiments)
+
+        sum_s = float(sum(sentiments))
+        amplifier = punctuation_emphasis(text)
+        if sum_s > 0:
+            sum_s += amplifier
+        elif sum_s < 0:
+            sum_s -= amplifier
+
+        return round(normalize(sum_s), 4)
+
+    def scalar_inc_dec(self, word, lower, valence, is_cap_diff):
+        scalar = self.boosters.get(lower)
+        if scalar is None:
+            return 0.0
+
+        if valence < 0:
+            scalar *= -1
+        if is_cap_diff and word.isupper():
+            scalar = scalar + C_INCR if valence > 0 else scalar - C_INCR
+        return scalar
+
+    @staticmethod
+    def never_check(valence, words, negated, start_i, i):
+        if start_i == 0:
+            if negated[i - 1]:
+                valence = valence * N_SCALAR
+        elif start_i == 1:
+            if words[i - 2] == 'never' and words[i - 1] in ('so', 'this'):
+                valence = valence * 1.5
+            elif negated[i - 2]:
+                valence = valence * N_SCALAR
+        else:
+            if (words[i - 3] == 'never' and words[i - 2] in ('so', 'this')) or words[i - 1] in ('so', 'this'):
+                valence = valence * 1.25
+            elif negated[i - 3]:
+                valence = valence * N_SCALAR
+        return valence
+
+    def idioms_check(self, valence, words, i):
+        idioms = self.idioms
+        twoone = '%s %s' % (words[i - 2], words[i - 1])
+        threetwo = '%s %s' % (words[i - 3], words[i - 2])
+
+        for seq in ('%s %s' % (words[i - 1], words[i]), '%s %s' % (twoone, words[i]), twoone,
+                    '%s %s %s' % (words[i - 3], words[i - 2], words[i - 1]), threetwo):
+            if seq in idioms:
+                valence = idioms[seq]
+                break
+
+        if len(words) - 1 > i:
+            zeroone = '%s %s' % (words[i], words[i + 1])
+            if zeroone in idioms:
+                valence = idioms[zeroone]
+        if len(words) - 1 > i + 1:
+            zeroonetwo = '%s %s %s' % (words[i], words[i + 1], words[i + 2])
+            if zeroonetwo in idioms:
+                valence = idioms[zeroonetwo]
+
+        if threetwo in self.boosters or twoone in self.boosters:
+            valence = valence + B_DECR
+        return valence
+
+    @staticmethod
+    def least_check(valence, lowers, known, i):
+        if i > 1 and not known[i - 1] and lowers[i - 1] == 'least':
+            if lowers[i - 2] != 'at' and lowers[i - 2] != 'very':
+                valence = valence * N_SCALAR
+        elif i > 0 and not known[i - 1] and lowers[i - 1] == 'least':
+            valence = valence * N_SCALAR
+        return valence
+
+    @staticmethod
+    def but_check(words, sentiments):
+        if 'but' not in words and 'BUT' not in words:
+            return sentiments
+
+        bi = words.index('but') if 'but' in words else words.index('BUT')
+        # As NLTK does it: each value rescales the first position holding an equal value, not its own
+        for sentiment in sentiments:
+            si = sentiments.index(sentiment)
+            if si < bi:
+                sentiments[si] = sentiment * 0.5
+            elif si > bi:
+                sentiments[si] = sentiment * 1.5
+        return sentiments
+
+
+def punctuation_emphasis(text):
+    ep_amplifier = min(text.count('!'), 4) * 0.292
+
+    qm_count = text.count('?')
+    qm_amplifier = 0
+    if qm_count > 1:
+        qm_amplifier = qm_count * 0.18 if qm_count <= 3 else 0.96
+
+    return ep_amplifier + qm_amplifier
@@ -1,37 +1,151 @@
 import argparse
+import logging
+import signal
+
 import api
 import core.analyser as analyser
-from core.domain import Database
+from core import metrics
+from core.backfill import Backfill
+from core.domain import Database, SubjectType
+from core.regions import Region
 
 
 def main():
     parser = argparse.ArgumentParser(description='SiteGeist: Analysing twitter sentiment in a geofenced area.')
 
-    parser.add_argument('-g', '--geofence', nargs='+', type=float)
+    parser.add_argument('-g', '--geofence', nargs=4, type=float, metavar=('LAT1', 'LONG1', 'LAT2', 'LONG2'),
+                        help="A single geofence, named 'default'")
+    parser.add_argument('-r', '--region', nargs=5, action='append', default=[],
+                        metavar=('NAME', 'LAT1', 'LONG1', 'LAT2', 'LONG2'),
+                        help='A named geofence. Repeat it to stream several regions at once, and filter the dashboard '
+                             'queries with ?region=NAME')
     parser.add_argument('-t', '--twitter-api-keys', nargs=4, type=str)
+    parser.add_argument('-b', '--batch-size', type=int, default=32,
+                        help='Maximum number of tweets annotated together')
+    parser.add_argument('-l', '--max-latency', type=float, default=1.0,
+                        help='Maximum seconds a tweet waits for its batch to fill')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='Number of worker processes for tweet analysis (0 analyses on the ingest thread)')
+    parser.add_argument('--flush-size', type=int, default=200,
+                        help='Number of pending tweets that triggers a database write')
+    parser.add_argument('--flush-interval', type=float, default=5.0,
+                        help='Maximum seconds a tweet waits before being written to the database')
+    parser.add_argument('--retention-days', type=int, default=7,
+                        help='Days of raw tweets to keep once summarised (0 keeps them all)')
+    parser.add_argument('--archive-dir', type=str,
+                        help='Directory to write expired tweets to, as gzipped JSON lines')
+    parser.add_argument('--production', action='store_true',
+                        help='Serve the web front end with waitress instead of the Flask development server')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Number of web server threads in production mode')
+    parser.add_argument('--backfill', nargs='+', metavar='FILE',
+                        help='Ingest tweets from JSON lines files (optionally gzipped) without connecting to twitter, '
+                             'then exit. An interrupted backfill resumes where it stopped')
+    parser.add_argument('--restart', action='store_true',
+                        help='With --backfill, read the files from the start rather than resuming')
+    parser.add_argument('--subjects', nargs='+', type=subject_type, default=analyser.SUBJECT_TYPES,
+                        metavar='TYPE', help='Subject types to extract, from entity, hashtag, mention, phrase, word and '
+                                             'emoji. Leaving out entity, phrase and word skips the spaCy components '
+                                             'they need')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG logs every tweet and its subjects')
+    parser.add_argument('--backfill-rollup', action='store_true',
+                        help='Rebuild the hourly subject rollup and heatmap tiles from the stored tweets, then exit')
+    parser.add_argument('--backfill-history', action='store_true',
+                        help='Write every day of subject summaries into the subject history, then exit')
 
     args = parser.parse_args()
 
-    locations = args.geofence
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(message)s')
+    # Exit normally on docker stop, so the atexit handlers flush the pending tweets
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        regions = parse_regions(args.geofence, args.region)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # The repository caches are warmed along with the models, after the web front end is up
+    with metrics.startup_phase('database'):
+        db = Database(warm=False)
+
+    if args.backfill_rollup:
+        rows = db.subjects.backfill_hourly()
+        logging.info('Wrote %d hourly subject rows', rows)
+        tiles = db.tweets.backfill_tiles()
+        logging.info('Wrote %d heatmap tile rows', tiles)
+        return
+
+    if args.backfill_history:
+        days = db.subjects.backfill_history()
+        logging.info('Wrote %d days of subject history', days)
+        return
+
+    if args.backfill:
+        ta = analyser.TweetAnalyser(regions, None, None, None, None, batch_size=args.batch_size,
+                                    workers=args.workers, flush_size=5000, flush_interval=60, stream=False,
+                                    subject_types=args.subjects, db=db)
+        backfill = Backfill(ta, checkpoint_size=5000)
+        for path in args.backfill:
+            backfill.run(path, restart=args.restart)
+        return
+
+    if not regions:
+        parser.error('At least one --geofence or --region is needed to stream tweets.')
     keys = args.twitter_api_keys
 
-    validate_lat_long(locations[0], locations[1])
-    validate_lat_long(locations[2], locations[3])
+    with metrics.startup_phase('analyser'):
+        ta = analyser.TweetAnalyser(regions, consumer_key=keys[0], consumer_secret=keys[1], access_token_key=keys[2],
+                                    access_token_secret=keys[3], batch_size=args.batch_size,
+                                    max_latency=args.max_latency, workers=args.workers, flush_size=args.flush_size,
+                                    flush_interval=args.flush_interval, retention_days=args.retention_days,
+                                    archive_dir=args.archive_dir, subject_types=args.subjects, db=db)
+
+    # start web front end, while the analyser warms up
+    api.start(db, ta, production=args.production, threads=args.threads)
+
+
+def terminate(signum, frame):
+    logging.info('Received signal %d, shutting down', signum)
+    raise SystemExit(0)
+
+
+def subject_type(name):
+    try:
+        subj_type = SubjectType[name.upper()]
+    except KeyError:
+        subj_type = SubjectType.ALL
+
+    if subj_type == SubjectType.ALL:
+        raise argparse.ArgumentTypeError('Unknown subject type. (%s)' % name)
+    return subj_type
 
-    ta = analyser.TweetAnalyser(locations[0], locations[1], locations[2], locations[3],
-                                consumer_key=keys[0], consumer_secret=keys[1], access_token_key=keys[2],
-                                access_token_secret=keys[3])
 
-    # start web front end
-    api.start(Database.instance, ta)
+def parse_regions(geofence, named):
+    """
+    :param geofence: the four corner coordinates of --geofence, or None
+    :param named: list of [name, lat1, long1, lat2, long2] for each --region
+    :return: list of Regions
+    """
+    regions = []
+    if geofence is not None:
+        regions.append(Region('default', *geofence))
 
+    for name, *corners in named:
+        try:
+            corners = [float(c) for c in corners]
+        except ValueError:
+            raise ValueError('Region corners must be numbers. (%s)' % name)
+        regions.append(Region(name, *corners))
 
-def validate_lat_long(lat, long):
-    if lat > 90 or lat < -90:
-        raise Exception('Latitude ranges from -90 to 90. (%d)' % lat)
+    names = [region.name for region in regions]
+    if len(set(names)) < len(names):
+        raise ValueError('Region names must be unique. (%s)' % ', '.join(names))
+    # The filter stream takes at most 25 bounding boxes
+    if len(regions) > 25:
+        raise ValueError('At most 25 regions can be streamed. (%d)' % len(regions))
 
-    if long > 180 or long < -180:
-        raise Exception('Longitude ranges from -180 to 180. (%d)' % long)
+    return regions
 
 
 if __name__ == '__main__':